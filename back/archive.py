@@ -0,0 +1,272 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import config
+import sales
+
+# Hot/cold order archiving. Orders older than a cutoff move, with their items, out of the main
+# database into one archive file per period (archive/orders-2024-05.db for monthly periods), so
+# the hot tables and their indexes stay small. archived_orders (migration 6) remembers where each
+# order went; order detail and history reads look there for ids the hot tables no longer hold and
+# ATTACH the archives they need behind UNION views (see history_views).
+#
+# Each batch is copied into the archive and committed first, then deleted from the main database in
+# a second transaction. Transactions across attached databases are not atomic in WAL mode; in this
+# order a crash can leave a batch in both places (re-running finishes the move, copies are
+# idempotent) but never in neither. Archived sales stay in the rollups (see sales.py).
+
+PERIOD_EXPRESSIONS = {"month": "substr(order_date, 1, 7)", "year": "substr(order_date, 1, 4)"}
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_orders (
+    order_id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    period TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_orders_customer_id ON archived_orders (customer_id);
+CREATE INDEX IF NOT EXISTS idx_orders_order_date ON orders (order_date);
+"""
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {schema}.orders (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    order_date TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS {schema}.order_items (
+    id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {schema}.idx_order_items_order_id ON order_items (order_id);
+CREATE INDEX IF NOT EXISTS {schema}.idx_orders_customer_id ON orders (customer_id);
+"""
+
+
+def archive_path(period, directory=config.ARCHIVE_DIR):
+    return os.path.join(directory, f"orders-{period}.db")
+
+
+# Attach each path as archive_0, archive_1, ...; yields the schema names and detaches on the way out
+@contextmanager
+def attached(connection, paths):
+    schemas = []
+    try:
+        for path in paths:
+            schema = f"archive_{len(schemas)}"
+            connection.execute(f"ATTACH DATABASE ? AS {schema};", (path,))
+            schemas.append(schema)
+        yield schemas
+    finally:
+        for schema in schemas:
+            connection.execute(f"DETACH DATABASE {schema};")
+
+
+HISTORY_VIEWS = {
+    "orders_history": "SELECT id, customer_id, order_date, status FROM {s}.orders",
+    "order_items_history": "SELECT id, order_id, product_id, quantity, price FROM {s}.order_items",
+    # Joined inside each arm: a filter on order_id is pushed into every arm and answered from its
+    # indexes, where joining orders_history to order_items_history would materialize every item
+    "order_lines_history": "SELECT o.id AS order_id, o.customer_id, o.order_date, o.status, i.id AS item_id, "
+                           "i.product_id, i.quantity, i.price "
+                           "FROM {s}.orders o LEFT JOIN {s}.order_items i ON i.order_id = o.id",
+}
+
+# Order details for archived (and hot) orders, same columns as sqlite_storage.ORDER_DETAIL_SQL
+HISTORY_DETAIL_SQL = """SELECT h.order_id, h.customer_id, h.order_date, h.status, h.item_id, h.product_id, p.name,
+    h.quantity, h.price FROM order_lines_history h LEFT JOIN products p ON p.id = h.product_id
+    WHERE h.order_id IN (SELECT value FROM json_each(?)) ORDER BY h.order_id, h.item_id;"""
+
+
+# Attach the archives and expose hot and archived rows together through the temporary UNION ALL
+# views in HISTORY_VIEWS (orders_history and order_items_history have the columns of orders and
+# order_items)
+@contextmanager
+def history_views(connection, paths):
+    with attached(connection, paths) as schemas:
+        sources = ["main"] + schemas
+        for name, select in HISTORY_VIEWS.items():
+            connection.execute(f"CREATE TEMP VIEW {name} AS " + " UNION ALL ".join(
+                select.format(s=s) for s in sources) + ";")
+        try:
+            yield
+        finally:
+            for name in HISTORY_VIEWS:
+                connection.execute(f"DROP VIEW temp.{name};")
+
+
+# Archive files to attach for the given archived order ids, in groups that fit under the
+# connection's ATTACH limit (one slot is left free). Orders whose archive file is gone are skipped.
+def archive_groups(connection, order_ids, directory=config.ARCHIVE_DIR):
+    periods = [row[0] for row in connection.execute(
+        "SELECT DISTINCT period FROM archived_orders WHERE order_id IN (SELECT value FROM json_each(?));",
+        (json.dumps(list(order_ids)),))]
+    paths = [path for path in (archive_path(period, directory) for period in sorted(periods)) if os.path.exists(path)]
+    size = max(connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - 1, 1)
+    return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+
+def has_archived_orders(connection, customer_id, before_id):
+    return connection.execute("SELECT 1 FROM archived_orders WHERE customer_id = ? AND order_id < ? LIMIT 1;",
+                              (customer_id, before_id)).fetchone() is not None
+
+# A customer's order ids with id < before_id across hot and archived orders, newest first
+def select_customer_order_ids(connection, customer_id, before_id, limit):
+    return [row[0] for row in connection.execute(
+        "SELECT id FROM orders WHERE customer_id = ? AND id < ? "
+        "UNION ALL SELECT order_id FROM archived_orders WHERE customer_id = ? AND order_id < ? "
+        "ORDER BY 1 DESC LIMIT ?;", (customer_id, before_id, customer_id, before_id, limit))]
+
+
+def cutoff_date(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Move every order older than cutoff (a "YYYY-MM-DD HH:MM:SS" string, like orders.order_date) into
+# its period's archive. progress(period, moved_so_far) is called after each batch. Returns the
+# number of orders moved. connection must be in autocommit mode (isolation_level=None).
+def archive_orders(connection, cutoff, directory=config.ARCHIVE_DIR, period=config.ARCHIVE_PERIOD,
+                   batch_size=config.ARCHIVE_BATCH_SIZE, pause=config.ARCHIVE_BATCH_PAUSE, progress=None):
+    key = PERIOD_EXPRESSIONS[period]
+    os.makedirs(directory, exist_ok=True)
+    moved = 0
+    periods = [row[0] for row in connection.execute(
+        f"SELECT DISTINCT {key} FROM orders WHERE order_date < ? ORDER BY 1;", (cutoff,))]
+    for name in periods:
+        with attached(connection, [archive_path(name, directory)]) as (schema,):
+            connection.executescript(ARCHIVE_SCHEMA.format(schema=schema))
+            while True:
+                ids = [row[0] for row in connection.execute(
+                    f"SELECT id FROM orders WHERE order_date < ? AND {key} = ? ORDER BY order_date, id LIMIT ?;",
+                    (cutoff, name, batch_size))]
+                if not ids:
+                    break
+                batch = json.dumps(ids)
+                # 1. copy: only the archive changes, so this commit is atomic
+                _run(connection, [
+                    (f"INSERT OR REPLACE INTO {schema}.orders (id, customer_id, order_date, status) "
+                     "SELECT id, customer_id, order_date, status FROM main.orders "
+                     "WHERE id IN (SELECT value FROM json_each(?));", (batch,)),
+                    (f"INSERT OR REPLACE INTO {schema}.order_items (id, order_id, product_id, quantity, price) "
+                     "SELECT id, order_id, product_id, quantity, price FROM main.order_items "
+                     "WHERE order_id IN (SELECT value FROM json_each(?));", (batch,)),
+                ])
+                # 2. forget: record where the orders went, then drop them from the hot tables
+                _run(connection, [
+                    (f"INSERT OR REPLACE INTO archived_orders (order_id, customer_id, period) "
+                     f"SELECT id, customer_id, ? FROM {schema}.orders WHERE id IN (SELECT value FROM json_each(?));",
+                     (name, batch)),
+                    ("DELETE FROM order_items WHERE order_id IN (SELECT value FROM json_each(?));", (batch,)),
+                    ("DELETE FROM orders WHERE id IN (SELECT value FROM json_each(?));", (batch,)),
+                ])
+                moved += len(ids)
+                if progress is not None:
+                    progress(name, moved)
+                if pause:
+                    time.sleep(pause)
+    return moved
+
+
+# Run (sql, params) statements in one write transaction
+def _run(connection, statements):
+    connection.execute("BEGIN IMMEDIATE;")
+    try:
+        for sql, params in statements:
+            connection.execute(sql, params)
+        connection.execute("COMMIT;")
+    except BaseException:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK;")
+        raise
+
+
+# Archived sales, summed per archive into a temporary table and added to the rollups in the same
+# transaction as sales.REBUILD_SQL, so a rebuild after archiving still counts every sale
+STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS archived_sales (
+    kind TEXT NOT NULL,
+    key,
+    total REAL NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+DELETE FROM temp.archived_sales;
+"""
+
+STAGE_ARCHIVE_SQL = """
+INSERT INTO temp.archived_sales (kind, key, total, quantity)
+    SELECT 'total', 1, COALESCE(SUM(quantity * price), 0), COALESCE(SUM(quantity), 0) FROM {schema}.order_items WHERE 1
+    ON CONFLICT(kind, key) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+INSERT INTO temp.archived_sales (kind, key, total, quantity)
+    SELECT 'product', product_id, SUM(quantity * price), SUM(quantity) FROM {schema}.order_items GROUP BY product_id
+    ON CONFLICT(kind, key) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+INSERT INTO temp.archived_sales (kind, key, total, quantity)
+    SELECT 'day', substr(o.order_date, 1, 10), SUM(i.quantity * i.price), SUM(i.quantity)
+    FROM {schema}.order_items i JOIN {schema}.orders o ON o.id = i.order_id GROUP BY substr(o.order_date, 1, 10)
+    ON CONFLICT(kind, key) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+INSERT INTO temp.archived_sales (kind, key, total, quantity)
+    SELECT 'customer', o.customer_id, SUM(i.quantity * i.price), SUM(i.quantity)
+    FROM {schema}.order_items i JOIN {schema}.orders o ON o.id = i.order_id GROUP BY o.customer_id
+    ON CONFLICT(kind, key) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+"""
+
+ADD_ARCHIVED_SALES_SQL = """
+UPDATE sales_totals SET
+    total = total + COALESCE((SELECT total FROM temp.archived_sales WHERE kind = 'total'), 0),
+    quantity = quantity + COALESCE((SELECT quantity FROM temp.archived_sales WHERE kind = 'total'), 0)
+    WHERE id = 1;
+INSERT INTO sales_by_product (product_id, total, quantity)
+    SELECT key, total, quantity FROM temp.archived_sales WHERE kind = 'product'
+    ON CONFLICT(product_id) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+INSERT INTO sales_by_day (day, total, quantity)
+    SELECT key, total, quantity FROM temp.archived_sales WHERE kind = 'day'
+    ON CONFLICT(day) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+INSERT INTO sales_by_customer (customer_id, total, quantity)
+    SELECT key, total, quantity FROM temp.archived_sales WHERE kind = 'customer'
+    ON CONFLICT(customer_id) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+"""
+
+
+# sales.rebuild_sales_rollups, counting archived orders too. Do not run it while archiving.
+def rebuild_sales_rollups(connection, directory=config.ARCHIVE_DIR):
+    connection.executescript(STAGE_SQL)
+    for path in sorted(glob.glob(os.path.join(directory, "orders-*.db"))):
+        with attached(connection, [path]) as (schema,):
+            connection.executescript(STAGE_ARCHIVE_SQL.format(schema=schema))
+    sales.rebuild_sales_rollups(connection, ADD_ARCHIVED_SALES_SQL)
+    connection.execute("DROP TABLE temp.archived_sales;")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old orders into per-period archive databases")
+    parser.add_argument("command", choices=["run", "list"])
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    parser.add_argument("--directory", help="archive directory (default: SHOP_ARCHIVE_DIR, or archive/ "
+                                            "next to the database)")
+    parser.add_argument("--older-than-days", type=int, default=config.ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--period", choices=sorted(PERIOD_EXPRESSIONS), default=config.ARCHIVE_PERIOD)
+    parser.add_argument("--batch-size", type=int, default=config.ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    directory = args.directory or os.getenv("SHOP_ARCHIVE_DIR") or os.path.join(
+        os.path.dirname(args.database), "archive")
+    connection = sqlite3.connect(args.database, isolation_level=None)
+    connection.execute(f"PRAGMA busy_timeout = {config.BUSY_TIMEOUT};")
+    if args.command == "run":
+        cutoff = cutoff_date(args.older_than_days)
+        moved = archive_orders(connection, cutoff, directory, args.period, args.batch_size,
+                               progress=lambda period, moved: print(f"  {period}: {moved} orders moved so far"))
+        print(f"Archived {moved} orders placed before {cutoff} into {directory}")
+    else:
+        for period, orders in connection.execute(
+                "SELECT period, COUNT(*) FROM archived_orders GROUP BY period ORDER BY period;"):
+            print(f"{period}  {orders:>8} orders  {archive_path(period, directory)}")
+    connection.close()
@@ -0,0 +1,220 @@
+import argparse
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import config
+
+# Online snapshots of the live database with SQLite's backup API. Pages are copied BACKUP_PAGES at
+# a time with a BACKUP_PAUSE sleep between steps; each step is a short read transaction on the source,
+# so API writers are only held up (rollback journal) or not at all (WAL) for one step at a time.
+#
+# A write from any other connection restarts the copy from the first page at the next step. On a busy
+# database that can happen forever, so after BACKUP_MAX_RESTARTS restarts the rest is copied in one
+# step: still a consistent snapshot and, in WAL mode, still without blocking writers.
+#
+# The copy goes to <name>.partial, is switched to a rollback journal so the snapshot is a single
+# self-contained file, passes PRAGMA integrity_check and only then is renamed into place. Archive
+# databases (archive.py) are not included; they only change while the archiver runs.
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def snapshot_path(source_path, directory=config.BACKUP_DIR, now=None):
+    now = now or datetime.now(timezone.utc)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(directory, f"{stem}-{now:%Y%m%dT%H%M%SZ}.db")
+
+
+# Snapshots of source_path in directory, oldest first (the timestamps sort as text)
+def list_snapshots(source_path, directory=config.BACKUP_DIR):
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return sorted(glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(stem)}-*Z.db")))
+
+
+# Delete all but the newest `keep` snapshots (keep <= 0 keeps everything); returns the deleted paths
+def prune_snapshots(source_path, directory=config.BACKUP_DIR, keep=config.BACKUP_KEEP):
+    if keep <= 0:
+        return []
+    deleted = list_snapshots(source_path, directory)[:-keep]
+    for path in deleted:
+        os.remove(path)
+    return deleted
+
+
+def check_integrity(path):
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in connection.execute("PRAGMA integrity_check;")]
+    finally:
+        connection.close()
+    return problems == ["ok"], problems
+
+
+# Copy source_path into target_path while the database stays in use. progress(copied, total, restarts)
+# is called after every step; cancelled is an optional threading.Event checked between steps.
+# Returns a summary dict; raises BackupError (and leaves no file behind) if the snapshot is unusable.
+def backup_database(source_path, target_path, pages=config.BACKUP_PAGES, pause=config.BACKUP_PAUSE,
+                    max_restarts=config.BACKUP_MAX_RESTARTS, progress=None, cancelled=None):
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    partial_path = target_path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    started = time.perf_counter()
+    restarts = 0
+    last_remaining = None
+
+    def on_step(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+        last_remaining = remaining
+        if progress is not None:
+            progress(total - remaining, total, restarts)
+        if cancelled is not None and cancelled.is_set():
+            raise BackupError("Backup cancelled")
+        if restarts > max_restarts and remaining > 0:
+            raise _Restarted()
+        if remaining > 0 and pause > 0:
+            time.sleep(pause)  # Connection.backup's own sleep only applies to busy or locked steps
+
+    source = sqlite3.connect(source_path)
+    source.execute(f"PRAGMA busy_timeout = {config.BUSY_TIMEOUT};")
+    target = sqlite3.connect(partial_path, isolation_level=None)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=on_step, sleep=pause)
+            single_step = False
+        except _Restarted:
+            last_remaining = None
+            source.backup(target, pages=-1, progress=on_step)
+            single_step = True
+        target.execute("PRAGMA journal_mode = DELETE;")
+        page_count = target.execute("PRAGMA page_count;").fetchone()[0]
+    except BaseException:
+        target.close()
+        source.close()
+        os.remove(partial_path)
+        raise
+    target.close()
+    source.close()
+
+    ok, problems = check_integrity(partial_path)
+    if not ok:
+        os.remove(partial_path)
+        raise BackupError("Snapshot failed the integrity check: " + "; ".join(problems[:10]))
+    os.replace(partial_path, target_path)
+    return {"path": target_path, "pages": page_count, "bytes": os.path.getsize(target_path),
+            "restarts": restarts, "single_step": single_step,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+# One backup at a time for the server: POST /admin/backup starts it on a thread, GET reads the status.
+# The thread has its own connections, so the backup never holds a pooled connection or the executor.
+class BackupJob:
+    def __init__(self):
+        self.running = False
+        self.started_at = None
+        self.finished_at = None
+        self.pages_copied = 0
+        self.pages_total = 0
+        self.restarts = 0
+        self.result = None  # summary of the last successful backup
+        self.error = None  # message of the last failed backup
+        self.last_success = None  # unix time of the last successful backup
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    # Returns False if a backup is already running
+    def start(self, source_path, directory=config.BACKUP_DIR, keep=config.BACKUP_KEEP):
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+            self.started_at = datetime.now(timezone.utc)
+            self.finished_at = None
+            self.pages_copied = self.pages_total = self.restarts = 0
+            self.error = None
+            self._cancelled.clear()
+        target_path = snapshot_path(source_path, directory, self.started_at)
+        threading.Thread(target=self._run, args=(source_path, target_path, directory, keep),
+                         name="shop-backup", daemon=True).start()
+        return True
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _progress(self, copied, total, restarts):
+        self.pages_copied, self.pages_total, self.restarts = copied, total, restarts
+
+    def _run(self, source_path, target_path, directory, keep):
+        try:
+            result = backup_database(source_path, target_path, progress=self._progress,
+                                     cancelled=self._cancelled)
+            result["pruned"] = prune_snapshots(source_path, directory, keep)
+            self.result = result
+            self.last_success = time.time()
+        except Exception as exc:
+            self.error = f"{type(exc).__name__}: {exc}"
+        finally:
+            with self._lock:
+                self.running = False
+                self.finished_at = datetime.now(timezone.utc)
+
+    def status(self):
+        return {"running": self.running,
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+                "pages_copied": self.pages_copied, "pages_total": self.pages_total,
+                "restarts": self.restarts, "last_result": self.result, "last_error": self.error}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Take an online snapshot of the shop database")
+    parser.add_argument("command", choices=["run", "list", "verify"])
+    parser.add_argument("path", nargs="?", help="snapshot to check (verify)")
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    parser.add_argument("--directory", help="snapshot directory (default: SHOP_BACKUP_DIR, or backups/ "
+                                            "next to the database)")
+    parser.add_argument("--pages", type=int, default=config.BACKUP_PAGES, help="pages copied per step")
+    parser.add_argument("--pause", type=float, default=config.BACKUP_PAUSE, help="seconds between steps")
+    parser.add_argument("--keep", type=int, default=config.BACKUP_KEEP,
+                        help="snapshots to keep, 0 keeps all")
+    args = parser.parse_args()
+    directory = args.directory or os.getenv("SHOP_BACKUP_DIR") or os.path.join(
+        os.path.dirname(args.database), "backups")
+    if args.command == "run":
+        def report(copied, total, restarts):
+            print(f"\r  {copied}/{total} pages ({copied * 100 // max(total, 1)}%)"
+                  + (f", {restarts} restarts" if restarts else ""), end="", flush=True)
+
+        target_path = snapshot_path(args.database, directory)
+        try:
+            result = backup_database(args.database, target_path, args.pages, args.pause, progress=report)
+        except BackupError as exc:
+            print()
+            raise SystemExit(str(exc))
+        print()
+        for path in prune_snapshots(args.database, directory, args.keep):
+            print(f"Removed old snapshot {path}")
+        print(f"Wrote {result['path']}: {result['pages']} pages, {result['bytes']} bytes in "
+              f"{result['seconds']} s, integrity ok")
+    elif args.command == "list":
+        for path in list_snapshots(args.database, directory):
+            print(f"{os.path.getsize(path):>12} bytes  {path}")
+    else:
+        if not args.path:
+            parser.error("verify needs the snapshot path")
+        ok, problems = check_integrity(args.path)
+        print("ok" if ok else "\n".join(problems))
+        if not ok:
+            raise SystemExit(1)
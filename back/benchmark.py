@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+# Load test / benchmark for the backend.
+#
+#   python benchmark.py                                 in-process through httpx's ASGI transport
+#   python benchmark.py --uvicorn                       against a real uvicorn server on a temp database
+#   python benchmark.py --save-baseline base.json       remember the results
+#   python benchmark.py --compare base.json             flag routes that got slower (exit status 1)
+#
+# Every run seeds a fresh temporary database, so results are reproducible for a given --seed.
+
+# Request mix: route label -> weight
+DEFAULT_MIX = {
+    "GET /products/{id}": 40,
+    "GET /products/?limit": 20,
+    "GET /sales/total": 10,
+    "POST /products/": 10,
+    "PUT /products/{id}": 10,
+    "POST /orders/checkout": 10,
+}
+
+
+def seed_database(path, products, customers, orders, items_per_order, rng):
+    import migrations
+    connection = sqlite3.connect(path, isolation_level=None)
+    migrations.migrate(connection)
+    connection.execute("BEGIN;")
+    connection.executemany("INSERT INTO products (name, price, quantity) VALUES (?, ?, ?);",
+                           ((f"product {i}", round(rng.uniform(1, 500), 2), 1_000_000) for i in range(products)))
+    connection.executemany("INSERT INTO customers (name, email) VALUES (?, ?);",
+                           ((f"customer {i}", f"customer{i}@example.com") for i in range(customers)))
+    connection.executemany("INSERT INTO orders (customer_id, order_date, status) VALUES (?, ?, 'placed');",
+                           ((rng.randint(1, customers), f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00")
+                            for _ in range(orders)))
+    connection.executemany("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?);",
+                           ((order_id, rng.randint(1, products), rng.randint(1, 5), round(rng.uniform(1, 500), 2))
+                            for order_id in range(1, orders + 1) for _ in range(items_per_order)))
+    connection.execute("COMMIT;")
+    connection.close()
+
+
+# Build the (label, method, url, body) list up front so every run sends the same requests
+def build_requests(count, mix, products, customers, rng):
+    labels = list(mix)
+    weights = [mix[label] for label in labels]
+    requests = []
+    for label in rng.choices(labels, weights, k=count):
+        product_id = rng.randint(1, products)
+        if label == "GET /products/{id}":
+            requests.append((label, "GET", f"/products/{product_id}", None))
+        elif label == "GET /products/?limit":
+            requests.append((label, "GET", f"/products/?after_id={rng.randint(0, products)}&limit=50", None))
+        elif label == "GET /products/?limit=1000":
+            requests.append((label, "GET", f"/products/?after_id={rng.randint(0, products)}&limit=1000", None))
+        elif label == "GET /products/":
+            requests.append((label, "GET", "/products/", None))
+        elif label == "GET /sales/total":
+            requests.append((label, "GET", "/sales/total", None))
+        elif label == "POST /products/":
+            requests.append((label, "POST", "/products/", {"name": "bench", "price": 1.0, "quantity": 10}))
+        elif label == "PUT /products/{id}":
+            requests.append((label, "PUT", f"/products/{product_id}",
+                             {"name": f"product {product_id}", "price": 2.0, "quantity": 1_000_000}))
+        elif label == "POST /orders/checkout":
+            requests.append((label, "POST", "/orders/checkout",
+                             {"customer_id": rng.randint(1, customers),
+                              "items": [{"product_id": rng.randint(1, products), "quantity": 1} for _ in range(3)]}))
+        else:
+            raise ValueError(f"Unknown route in mix: {label}")
+    return requests
+
+
+async def drive(client, requests, concurrency):
+    latencies = {}
+    errors = {}
+    queue = list(reversed(requests))
+
+    async def worker():
+        while queue:
+            label, method, url, body = queue.pop()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.setdefault(label, []).append(time.perf_counter() - start)
+            if failed:
+                errors[label] = errors.get(label, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    routes = {}
+    for label, values in sorted(latencies.items()):
+        values = sorted(values)
+        routes[label] = {
+            "count": len(values),
+            "errors": errors.get(label, 0),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+    total = sum(len(v) for v in latencies.values())
+    return {"requests": total, "elapsed_s": elapsed, "throughput_rps": total / elapsed if elapsed else 0.0,
+            "routes": routes}
+
+
+def print_report(result):
+    print(f"{'route':28} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, r in result["routes"].items():
+        print(f"{label:28} {r['count']:>7} {r['errors']:>7} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+    print(f"\n{result['requests']} requests in {result['elapsed_s']:.2f}s = {result['throughput_rps']:.0f} req/s")
+
+
+# Routes whose p95 grew, or overall throughput that dropped, by more than tolerance (0.2 = 20%)
+def find_regressions(result, baseline, tolerance):
+    regressions = []
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput_rps']:.0f} -> {result['throughput_rps']:.0f} req/s")
+    for label, r in result["routes"].items():
+        before = baseline["routes"].get(label)
+        if before and r["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label} p95 {before['p95_ms']:.2f} -> {r['p95_ms']:.2f} ms")
+    return regressions
+
+
+async def run_in_process(requests, concurrency):
+    import main
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await drive(client, requests, concurrency)
+
+
+async def run_against_server(base_url, requests, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        return await drive(client, requests, concurrency)
+
+
+def start_uvicorn(database, workers):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, SHOP_DATABASE_PATH=database)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                               "--workers", str(workers), "--log-level", "warning"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(base_url + "/sales/total", timeout=1)
+            return server, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shop backend")
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--customers", type=int, default=1_000)
+    parser.add_argument("--orders", type=int, default=5_000)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX,
+                        help='route weights as JSON, e.g. \'{"GET /products/{id}": 1}\'')
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--uvicorn", action="store_true", help="run against a real uvicorn server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (with --uvicorn)")
+    parser.add_argument("--storage", choices=["sqlite", "memory"], default="sqlite",
+                        help="storage engine; memory loads the seeded database as a snapshot "
+                             "(each uvicorn worker gets its own copy)")
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "bench.db")
+        # must be set before config is first imported (by seed_database or main)
+        os.environ["SHOP_DATABASE_PATH"] = database
+        os.environ["SHOP_STORAGE"] = args.storage
+        os.environ["SHOP_MEMORY_SNAPSHOT"] = database
+        seed_database(database, args.products, args.customers, args.orders, args.items_per_order, rng)
+        requests = build_requests(args.requests, args.mix, args.products, args.customers, rng)
+        if args.uvicorn:
+            server, base_url = start_uvicorn(database, args.workers)
+            try:
+                latencies, errors, elapsed = asyncio.run(run_against_server(base_url, requests, args.concurrency))
+            finally:
+                server.terminate()
+                server.wait()
+        else:
+            latencies, errors, elapsed = asyncio.run(run_in_process(requests, args.concurrency))
+
+    result = summarize(latencies, errors, elapsed)
+    print_report(result)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = find_regressions(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION  {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import codecs
+import csv
+import json
+import sqlite3
+
+# Helpers for POST /products/bulk: parse the request body row by row and write rows in chunks
+
+
+class RowError(Exception):
+    pass
+
+
+MAX_CSV_RECORD_SIZE = 1024 * 1024  # bytes; a quoted field left open swallows at most this much
+
+
+# Split a streamed body into lines without reading it all into memory. Yields (text, ok) per line:
+# ok is False when the line is not valid UTF-8 (text then has U+FFFD in place of the bad bytes).
+# A UTF-8 byte order mark at the start of the body, as Excel writes, is dropped.
+async def iter_lines(request):
+    buffer = b""
+    first = True
+    async for data in request.stream():
+        buffer += data
+        if first and len(buffer) >= 3:
+            buffer = buffer.removeprefix(codecs.BOM_UTF8)
+            first = False
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield decode_line(line)
+    if first:
+        buffer = buffer.removeprefix(codecs.BOM_UTF8)
+    if buffer:
+        yield decode_line(buffer)
+
+
+def decode_line(line):
+    line = line.rstrip(b"\r")
+    try:
+        return line.decode("utf-8"), True
+    except UnicodeDecodeError:
+        return line.decode("utf-8", errors="replace"), False
+
+
+# Group lines into CSV records, so a quoted field may contain newlines. Yields (values, error) per
+# record; a record is parsed again as each line arrives until csv no longer runs out of data.
+async def iter_csv_records(request):
+    pending, size, ok = [], 0, True
+    async for line, line_ok in iter_lines(request):
+        if not pending and not line.strip():
+            continue
+        pending.append(line)
+        size += len(line)
+        ok = ok and line_ok
+        if len(pending) > 1 and '"' not in line and size < MAX_CSV_RECORD_SIZE:
+            continue  # still inside the quoted field that opened on an earlier line
+        try:
+            values = next(csv.reader(["\n".join(pending)], strict=True))
+        except csv.Error as e:
+            if "unexpected end of data" in str(e) and size < MAX_CSV_RECORD_SIZE:
+                continue
+            yield None, f"Invalid CSV record: {e}"
+        else:
+            yield values, None if ok else "Invalid UTF-8 in CSV record"
+        pending, size, ok = [], 0, True
+    if pending:
+        yield None, "Invalid CSV record: unterminated quoted field"
+
+
+# Yield one dict per row (or a RowError for rows that cannot be parsed).
+# JSON arrays are parsed in one go; NDJSON and CSV bodies are parsed as they stream in.
+async def iter_rows(request):
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip()
+    if content_type == "application/json":
+        try:
+            rows = json.loads(await request.body())
+        except ValueError as e:
+            raise RowError(f"Invalid JSON body: {e}")
+        if not isinstance(rows, list):
+            raise RowError("Expected a JSON array of products")
+        for row in rows:
+            yield row
+    elif content_type in ("application/x-ndjson", "application/jsonl"):
+        async for line, ok in iter_lines(request):
+            if not line.strip():
+                continue
+            if not ok:
+                yield RowError("Invalid UTF-8 in JSON line")
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield RowError(f"Invalid JSON line: {e}")
+    elif content_type == "text/csv":
+        header = None
+        async for values, error in iter_csv_records(request):
+            if header is None:
+                if error:
+                    raise RowError(f"Invalid CSV header: {error}")
+                header = [h.strip() for h in values]
+                continue
+            if error:
+                yield RowError(error)
+                continue
+            if len(values) != len(header):
+                yield RowError(f"Expected {len(header)} columns, got {len(values)}")
+                continue
+            # empty id column means "insert as new product"
+            yield {h: v for h, v in zip(header, values) if not (h == "id" and v == "")}
+    else:
+        raise RowError(f"Unsupported content type: {content_type}")
+
+
+UPSERT_SQL = """INSERT INTO products (id, name, price, quantity) VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET name = excluded.name, price = excluded.price,
+                quantity = excluded.quantity;"""
+INSERT_SQL = "INSERT INTO products (name, price, quantity) VALUES (?, ?, ?);"
+
+
+# Write one chunk of validated rows in the current transaction.
+# rows is a list of (index, id or None, name, price, quantity); returns ({index: id}, {index: error}).
+def write_products_chunk(connection, rows):
+    upserts = [r for r in rows if r[1] is not None]
+    inserts = [r for r in rows if r[1] is None]
+    ids, errors = {}, {}
+    connection.execute("SAVEPOINT bulk_chunk;")
+    try:
+        if upserts:
+            connection.executemany(UPSERT_SQL, [r[1:] for r in upserts])
+        if inserts:
+            connection.executemany(INSERT_SQL, [r[2:] for r in inserts])
+            # AUTOINCREMENT ids of one executemany inside a write transaction are consecutive
+            last_id = connection.execute("SELECT last_insert_rowid();").fetchone()[0]
+            first_id = last_id - len(inserts) + 1
+            for offset, r in enumerate(inserts):
+                ids[r[0]] = first_id + offset
+        for r in upserts:
+            ids[r[0]] = r[1]
+        connection.execute("RELEASE bulk_chunk;")
+        return ids, errors
+    except sqlite3.DatabaseError:
+        connection.execute("ROLLBACK TO bulk_chunk;")
+        connection.execute("RELEASE bulk_chunk;")
+
+    # Something in the chunk was rejected: fall back to row by row to find the bad rows
+    ids = {}
+    for r in rows:
+        try:
+            if r[1] is None:
+                ids[r[0]] = connection.execute(INSERT_SQL, r[2:]).lastrowid
+            else:
+                connection.execute(UPSERT_SQL, r[1:])
+                ids[r[0]] = r[1]
+        except sqlite3.DatabaseError as e:
+            errors[r[0]] = str(e)
+    return ids, errors
@@ -0,0 +1,99 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+
+import compression
+import config
+
+
+# Bounded in-process cache: entries expire after ttl seconds, and the least recently used entry
+# is dropped when the cache is full. Only used from the event loop, so no locking is needed.
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # bumped on every invalidation, so a fill that started before a write can be discarded
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    # generation is the value read before the data was loaded; stale fills are ignored
+    def put(self, key, value, generation=None):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    # Drop every entry for which predicate(key, value) is true
+    def invalidate_where(self, predicate):
+        self.generation += 1
+        for key in [key for key, (_, value) in self._data.items() if predicate(key, value)]:
+            del self._data[key]
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+
+# A serialized JSON body with its ETag, ready to be served again. There is no Last-Modified: its one
+# second resolution would answer 304 for a change made in the same second as the previous fill.
+class CachedResponse:
+    def __init__(self, body, headers=None, upper=None):
+        self.body = body
+        self.headers = headers or {}
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.upper = upper  # for list pages: highest id the page covers (None = open-ended)
+        self._encoded = {}  # encoding -> compressed body, so a hot page is compressed once
+
+    def encoded_body(self, encoding):
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = self._encoded[encoding] = compression.compress(self.body, encoding)
+        return body
+
+    def is_fresh_for(self, request):
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags
+        return False
+
+    # 304 when the client already holds this version, the full body otherwise (compressed when the
+    # client accepts it and the body is large enough)
+    def to_response(self, request):
+        encoding = None
+        if len(self.body) >= config.COMPRESSION_MIN_SIZE:
+            encoding = compression.negotiate(request.headers.get("accept-encoding"))
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache", **self.headers}
+        if encoding is not None:
+            headers.update({"ETag": compression.weak_etag(self.etag), "Content-Encoding": encoding,
+                            "Vary": "Accept-Encoding"})
+        if self.is_fresh_for(request):
+            return Response(status_code=304, headers=headers)
+        body = self.body if encoding is None else self.encoded_body(encoding)
+        return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,83 @@
+import asyncio
+
+import encoders
+
+# Product change log for delta sync. Every insert, update and delete of a product moves the product
+# to a new, strictly increasing version in product_changes (one row per product; deleted products
+# stay behind as tombstones). GET /products/changes?since=V and the WebSocket feed read the rows
+# with version > V. Triggers keep the log, so every write path (bulk, checkout stock) is covered.
+# The table is created by migration 4 (migrations.py).
+
+CHANGELOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS product_changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL UNIQUE,
+    deleted INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS product_changes_insert AFTER INSERT ON products BEGIN
+    DELETE FROM product_changes WHERE product_id = NEW.id;
+    INSERT INTO product_changes (product_id, deleted) VALUES (NEW.id, 0);
+END;
+CREATE TRIGGER IF NOT EXISTS product_changes_update AFTER UPDATE OF name, price, quantity ON products BEGIN
+    DELETE FROM product_changes WHERE product_id = NEW.id;
+    INSERT INTO product_changes (product_id, deleted) VALUES (NEW.id, 0);
+END;
+CREATE TRIGGER IF NOT EXISTS product_changes_delete AFTER DELETE ON products BEGIN
+    DELETE FROM product_changes WHERE product_id = OLD.id;
+    INSERT INTO product_changes (product_id, deleted) VALUES (OLD.id, 1);
+END;
+"""
+
+# Existing products start out at versions 1..n, in id order
+BACKFILL_SQL = """
+INSERT INTO product_changes (product_id, deleted) SELECT id, 0 FROM products ORDER BY id;
+"""
+
+CHANGE_COLUMNS = ("version", "id", "deleted", "name", "price", "quantity")
+
+
+# Rows are (version, id, deleted, name, price, quantity); name, price and quantity are None for deletes
+def select_product_changes(connection, since, limit):
+    return connection.execute("SELECT c.version, c.product_id, c.deleted, p.name, p.price, p.quantity "
+                              "FROM product_changes c LEFT JOIN products p ON p.id = c.product_id "
+                              "WHERE c.version > ? ORDER BY c.version LIMIT ?;", (since, limit)).fetchall()
+
+def select_changes_version(connection):
+    return connection.execute("SELECT COALESCE(MAX(version), 0) FROM product_changes;").fetchone()[0]
+
+
+# {"version": cursor for the next call, "has_more": another page is waiting, "changes": [...]};
+# a deleted product is reported as {"version", "id", "deleted": true}
+def changes_to_json(rows, since, has_more):
+    changes = []
+    for row in rows:
+        if row[2]:
+            changes.append({"version": row[0], "id": row[1], "deleted": True})
+        else:
+            changes.append(dict(zip(CHANGE_COLUMNS, row), deleted=False))
+    return encoders.dumps({"version": rows[-1][0] if rows else since, "has_more": has_more, "changes": changes})
+
+
+# Wakes WebSocket subscribers after product writes commit in this process. Subscribers re-read the
+# change log from their own cursor, so a missed or merged wake-up never loses a change; they also
+# poll every CHANGE_FEED_POLL_SECONDS to pick up writes made by other worker processes.
+class ChangeFeed:
+    def __init__(self):
+        self._subscribers = set()
+
+    def subscribe(self):
+        event = asyncio.Event()
+        self._subscribers.add(event)
+        return event
+
+    def unsubscribe(self, event):
+        self._subscribers.discard(event)
+
+    def notify(self):
+        for event in self._subscribers:
+            event.set()
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
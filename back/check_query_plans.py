@@ -0,0 +1,185 @@
+import itertools
+import sqlite3
+import sys
+import tempfile
+
+import archive
+import changes
+import encoders
+import migrations
+import sales
+import search
+import sqlite_storage
+from bulk import write_products_chunk
+
+# Query-plan regression check: calls the query functions behind each endpoint against a freshly
+# migrated database, runs EXPLAIN QUERY PLAN for every statement they execute, and fails when one
+# of them scans a whole table.
+#   python check_query_plans.py        (exit status 1 on a regression)
+# It also checks that the product listing keeps id order for every ?fields= projection.
+# The statements are captured as they run, so changing a query is checked as-is; when you add an
+# endpoint, add a call for it to calls().
+
+NEWEST = 2 ** 63 - 1  # before_id of a customer's first order history page
+
+
+# Moves order 1 back in time so the archive run below has something to move (not checked)
+def backdate_first_order(connection):
+    sqlite3.Connection.execute(connection, "UPDATE orders SET order_date = '2020-01-15 10:00:00' WHERE id = 1;")
+
+
+# (endpoint, function, args) in the order they run: later calls rely on the rows earlier ones wrote.
+# Functions take the connection as their first argument. The unpaginated GET /products/ reads every
+# row on purpose and is not listed.
+def calls(archive_dir):
+    return [
+        ("POST /products/", sqlite_storage.insert_product, ("apple pie", 2.5, 10)),
+        ("POST /products/bulk", write_products_chunk, ([(0, None, "banana", 1.0, 5), (1, None, "cherry", 3.0, 7),
+                                                        (2, 1, "apple tart", 2.5, 10)],)),
+        ("GET /products/?after_id&limit", sqlite_storage.select_products_page, (0, 10)),
+        ("GET /products/?fields=", sqlite_storage.select_products_page, (0, 10, ("id", "name"))),
+        ("GET /products/{id}", sqlite_storage.select_product, (1,)),
+        ("POST /products/lookup", sqlite_storage.select_products, ([1, 2],)),
+        ("GET /products/search", search.select_search, (search.match_expression("app"), 20)),
+        ("PUT /products/{id}", sqlite_storage.update_product_row, (2, "banana split", 1.5, 4)),
+        ("DELETE /products/{id}", sqlite_storage.delete_product_row, (3,)),
+        ("GET /products/changes", changes.select_product_changes, (0, 10)),
+        ("product cache sync", changes.select_changes_version, ()),
+        ("POST /customers/", sqlite_storage.insert_customer, ("Ann", "ann@example.com")),
+        ("POST /customers/lookup (ids)", sqlite_storage.select_customers, ([1],)),
+        ("POST /customers/lookup (emails)", sqlite_storage.select_customers_by_email, (["ann@example.com"],)),
+        ("POST /orders/checkout", sqlite_storage.place_order, (1, "placed", {1: 1, 2: 1})),
+        ("POST /orders/checkout", sqlite_storage.place_order, (1, "placed", {2: 1})),
+        ("GET /orders/{id}", sqlite_storage.select_order, (1,)),
+        ("GET /orders/{id}", sqlite_storage.select_order_items, (1,)),
+        ("GET /orders/{id}, POST /orders/lookup", sqlite_storage.select_order_details, ([1, 2], archive_dir)),
+        ("GET /customers/{id}/orders", sqlite_storage.select_customer_orders, (1, NEWEST, 10, archive_dir)),
+        ("GET /sales/total", sales.select_total, ()),
+        ("GET /sales/products/{id}", sales.select_product_sales, (1,)),
+        ("GET /sales/customers/{id}", sales.select_customer_sales, (1,)),
+        ("GET /sales/daily", sales.select_daily_sales, ("2020-01-01", "2030-12-31")),
+        (None, backdate_first_order, ()),
+        ("archive run", archive.archive_orders, ("2021-01-01 00:00:00", archive_dir, "month", 500, 0)),
+        ("GET /orders/{id} (archived order)", sqlite_storage.select_order_details, ([1, 2], archive_dir)),
+        ("GET /customers/{id}/orders (with archived orders)", sqlite_storage.select_customer_orders,
+         (1, NEWEST, 10, archive_dir)),
+    ]
+
+
+# Statements SQLite runs on its own (trigger bodies, foreign key checks), which EXPLAIN cannot reach
+# through the statement that fires them, and lookups that exist only as an index
+INTERNAL_QUERIES = [
+    ("DELETE /products/{id} (foreign key check)", "SELECT 1 FROM order_items WHERE product_id = ?;", (1,)),
+    ("sales triggers (order lookup)", "SELECT customer_id FROM orders WHERE id = ?;", (1,)),
+    ("sales triggers (items of an order)", "SELECT SUM(quantity * price) FROM order_items WHERE order_id = ?;", (1,)),
+    ("sales trigger (archived order check)", "SELECT 1 FROM archived_orders WHERE order_id = ?;", (1,)),
+    ("product change triggers", "DELETE FROM product_changes WHERE product_id = ?;", (1,)),
+    ("products by name", "SELECT id FROM products WHERE name = ?;", ("a",)),
+]
+
+
+# Runs EXPLAIN QUERY PLAN before every statement executed through it and keeps the plans in
+# connection.plans as (sql, plan details)
+class ExplainingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        self.connection.explain(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        if seq_of_parameters:
+            self.connection.explain(sql, seq_of_parameters[0])
+        return super().executemany(sql, seq_of_parameters)
+
+
+class ExplainingConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plans = []
+
+    def cursor(self, factory=ExplainingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def explain(self, sql, parameters):
+        self.plans.append((sql, query_plan(self, sql, parameters)))
+
+
+def query_plan(connection, sql, params):
+    try:
+        # plain Connection.execute, so the EXPLAIN itself is not recorded
+        return [row[3] for row in sqlite3.Connection.execute(connection, "EXPLAIN QUERY PLAN " + sql, params)]
+    except sqlite3.Error:
+        return []  # BEGIN, ATTACH and the like have no plan
+
+
+# A plan walks a whole table or index ("SCAN ...") instead of searching it ("SEARCH ..."). Virtual
+# table scans are fine: json_each walks an id list parameter and products_fts answers MATCH from its
+# own index. So is SCAN CONSTANT ROW, a SELECT without a FROM.
+def is_scan(plan):
+    return any(detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail and detail != "SCAN CONSTANT ROW"
+               for detail in plan)
+
+
+# Returns (number of statements checked, [(endpoint, sql, plan)] for every one that scans)
+def find_scans(connection, archive_dir):
+    checked, problems = 0, []
+    for endpoint, function, args in calls(archive_dir):
+        connection.plans = []
+        function(connection, *args)
+        if endpoint is None:
+            continue
+        for sql, plan in connection.plans:
+            if not plan:
+                continue
+            checked += 1
+            if is_scan(plan):
+                problems.append((endpoint, sql, plan))
+    for endpoint, sql, params in INTERNAL_QUERIES:
+        checked += 1
+        plan = query_plan(connection, sql, params)
+        if is_scan(plan):
+            problems.append((endpoint, sql, plan))
+    return checked, problems
+
+
+# The unpaginated GET /products/ must return id order for every ?fields= projection, even when a
+# covering index (idx_products_name) would hand the rows back in another order. Returns the
+# projections that do not.
+def find_unordered_lists(connection):
+    names = ["zucchini", "yam", "apple", "mango", "banana"]  # name order differs from id order
+    connection.executemany("INSERT INTO products (name, price, quantity) VALUES (?, 1.0, 1);",
+                           [(name,) for name in names])
+    others = [column for column in encoders.PRODUCT_COLUMNS if column != "id"]
+    problems = []
+    for size in range(len(others) + 1):
+        for chosen in itertools.combinations(others, size):
+            columns = tuple(column for column in encoders.PRODUCT_COLUMNS if column == "id" or column in chosen)
+            ids = [row[0] for row in sqlite_storage.select_all_products(connection, columns)]
+            if ids != sorted(ids):
+                problems.append((columns, ids))
+    return problems
+
+
+def main():
+    connection = sqlite3.connect(":memory:", isolation_level=None, factory=ExplainingConnection)
+    migrations.migrate(connection)
+    with tempfile.TemporaryDirectory() as archive_dir:
+        checked, problems = find_scans(connection, archive_dir)
+        unordered = find_unordered_lists(connection)
+        connection.close()
+    for endpoint, sql, plan in problems:
+        print(f"FULL SCAN  {endpoint}: {' '.join(sql.split())}\n    {' | '.join(plan)}")
+    for columns, ids in unordered:
+        print(f"NOT IN ID ORDER  GET /products/?fields={','.join(columns)}: ids {ids}")
+    print(f"{checked - len(problems)}/{checked} statements use an index")
+    return 1 if problems or unordered else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
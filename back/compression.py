@@ -0,0 +1,136 @@
+import zlib
+
+import config
+
+# Negotiated response compression. Brotli is used when the client accepts it and the brotli package
+# is installed, gzip otherwise. Bodies under COMPRESSION_MIN_SIZE bytes are sent as they are: the
+# headers would eat most of the saving.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+# Pick the encoding for an Accept-Encoding header: br, then gzip, or None for identity
+def negotiate(accept_encoding):
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip())
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+# Incremental compressor; flush() emits everything compressed so far, so a streamed response
+# reaches the client chunk by chunk instead of waiting for the compressor's buffer to fill
+class Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=config.BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(config.GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+    def compress(self, data, flush=False):
+        if self.encoding == "br":
+            return self._brotli.process(data) + (self._brotli.flush() if flush else b"")
+        return self._zlib.compress(data) + (self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else b"")
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def compress(body, encoding):
+    compressor = Compressor(encoding)
+    return compressor.compress(body) + compressor.finish()
+
+
+# A compressed body is a different representation, so a strong ETag must not be shared with the
+# identity one; the weak form still matches If-None-Match (see cache.CachedResponse.is_fresh_for)
+def weak_etag(etag):
+    return etag if etag.startswith("W/") else "W/" + etag
+
+
+def _is_compressible(headers):
+    content_type = headers.get("content-type", "")
+    return "content-encoding" not in headers and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+# ASGI middleware compressing JSON, NDJSON and text responses. Responses that already carry a
+# Content-Encoding (cached pages, see cache.py) pass through untouched.
+class CompressionMiddleware:
+    def __init__(self, app, min_size=None):
+        self.app = app
+        self.min_size = config.COMPRESSION_MIN_SIZE if min_size is None else min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), None)
+        encoding = negotiate(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message  # held back until we know whether the body gets compressed
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if start is None:  # already decided: pass through, or keep compressing a stream
+                if compressor is not None:
+                    body = compressor.compress(message.get("body", b""), flush=True)
+                    if not message.get("more_body", False):
+                        body += compressor.finish()
+                    message = {**message, "body": body}
+                await send(message)
+                return
+
+            response_start, start = start, None
+            headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in response_start["headers"]}
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if not _is_compressible(headers) or (not more_body and len(body) < self.min_size):
+                await send(response_start)
+                await send(message)
+                return
+
+            compressor = Compressor(encoding)
+            if more_body:
+                body = compressor.compress(body, flush=True)
+            else:
+                body = compressor.compress(body) + compressor.finish()
+            raw_headers = [(k, v) for k, v in response_start["headers"] if k.lower() not in (b"content-length", b"etag")]
+            raw_headers.append((b"content-encoding", encoding.encode()))
+            raw_headers.append((b"vary", b"Accept-Encoding"))
+            if "etag" in headers:
+                raw_headers.append((b"etag", weak_etag(headers["etag"]).encode("latin-1")))
+            if not more_body:
+                raw_headers.append((b"content-length", str(len(body)).encode()))
+            await send({**response_start, "headers": raw_headers})
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
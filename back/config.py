@@ -0,0 +1,73 @@
+import os
+
+# Settings for the backend. Every value can be overridden with an environment variable.
+
+# Storage engine: "sqlite" (the database file below) or "memory" (indexed dicts, optionally loaded
+# from a snapshot of a SQLite database at start-up)
+STORAGE_BACKEND = os.getenv("SHOP_STORAGE", "sqlite")
+MEMORY_SNAPSHOT_PATH = os.getenv("SHOP_MEMORY_SNAPSHOT")
+
+# Database file
+DATABASE_PATH = os.getenv("SHOP_DATABASE_PATH", "simple_shop.db")
+
+# Connection pool
+POOL_SIZE = int(os.getenv("SHOP_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("SHOP_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+
+# Async access: how many reads may run at once (writes always run one at a time)
+READ_CONCURRENCY = int(os.getenv("SHOP_READ_CONCURRENCY", str(max(POOL_SIZE - 1, 1))))
+
+# Group commit: the writer commits up to WRITE_BATCH_SIZE queued writes per transaction, waiting at
+# most WRITE_MAX_WAIT_MS for more to arrive (0 = only take what is already queued)
+WRITE_BATCH_SIZE = int(os.getenv("SHOP_WRITE_BATCH_SIZE", "64"))
+WRITE_MAX_WAIT_MS = float(os.getenv("SHOP_WRITE_MAX_WAIT_MS", "0"))
+
+# SQLite pragmas applied to every pooled connection
+JOURNAL_MODE = os.getenv("SHOP_JOURNAL_MODE", "WAL")
+SYNCHRONOUS = os.getenv("SHOP_SYNCHRONOUS", "NORMAL")
+CACHE_SIZE = int(os.getenv("SHOP_CACHE_SIZE", "-16000"))  # negative means KiB, so about 16 MB
+MMAP_SIZE = int(os.getenv("SHOP_MMAP_SIZE", str(64 * 1024 * 1024)))
+BUSY_TIMEOUT = int(os.getenv("SHOP_BUSY_TIMEOUT", "5000"))  # milliseconds
+
+# Product listing
+MAX_PAGE_SIZE = int(os.getenv("SHOP_MAX_PAGE_SIZE", "1000"))
+SEARCH_PAGE_SIZE = int(os.getenv("SHOP_SEARCH_PAGE_SIZE", "20"))  # default ?limit for /products/search
+MAX_LOOKUP_IDS = int(os.getenv("SHOP_MAX_LOOKUP_IDS", "1000"))  # ids per batch lookup request
+STREAM_CHUNK_SIZE = int(os.getenv("SHOP_STREAM_CHUNK_SIZE", "500"))  # rows fetched per step when streaming
+BULK_CHUNK_SIZE = int(os.getenv("SHOP_BULK_CHUNK_SIZE", "1000"))  # rows per transaction in bulk import
+
+# Order archiving (archive.py): orders older than ARCHIVE_AFTER_DAYS move, with their items, into one
+# database file per period (month or year) in ARCHIVE_DIR, ARCHIVE_BATCH_SIZE orders per transaction
+ARCHIVE_DIR = os.getenv("SHOP_ARCHIVE_DIR") or os.path.join(os.path.dirname(DATABASE_PATH), "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("SHOP_ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_PERIOD = os.getenv("SHOP_ARCHIVE_PERIOD", "month")
+ARCHIVE_BATCH_SIZE = int(os.getenv("SHOP_ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_BATCH_PAUSE = float(os.getenv("SHOP_ARCHIVE_BATCH_PAUSE", "0.05"))  # seconds between batches, lets API writes in
+
+# Online snapshots (backup.py): BACKUP_PAGES pages per backup step with BACKUP_PAUSE seconds between
+# steps; BACKUP_INTERVAL > 0 makes the server take one every BACKUP_INTERVAL seconds (3600 for hourly)
+BACKUP_DIR = os.getenv("SHOP_BACKUP_DIR") or os.path.join(os.path.dirname(DATABASE_PATH), "backups")
+BACKUP_PAGES = int(os.getenv("SHOP_BACKUP_PAGES", "256"))  # 1 MiB per step with 4 KiB pages
+BACKUP_PAUSE = float(os.getenv("SHOP_BACKUP_PAUSE", "0.01"))
+BACKUP_MAX_RESTARTS = int(os.getenv("SHOP_BACKUP_MAX_RESTARTS", "3"))  # then copy the rest in one step
+BACKUP_KEEP = int(os.getenv("SHOP_BACKUP_KEEP", "48"))  # newest snapshots kept, 0 keeps all
+BACKUP_INTERVAL = float(os.getenv("SHOP_BACKUP_INTERVAL", "0"))  # seconds, 0 = off
+
+# Product change feed (GET /products/changes and the WebSocket at /products/changes/ws)
+CHANGES_PAGE_SIZE = int(os.getenv("SHOP_CHANGES_PAGE_SIZE", "1000"))  # changes per response or message
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("SHOP_CHANGE_FEED_POLL_SECONDS", "1"))  # catches other workers' writes
+
+# Product read cache (set SHOP_CACHE_TTL=0 to disable)
+CACHE_TTL = float(os.getenv("SHOP_CACHE_TTL", "30"))  # seconds
+CACHE_SYNC_SECONDS = float(os.getenv("SHOP_CACHE_SYNC_SECONDS", "1"))  # how soon other workers' writes show
+PRODUCT_CACHE_SIZE = int(os.getenv("SHOP_PRODUCT_CACHE_SIZE", "10000"))  # single products
+LIST_CACHE_SIZE = int(os.getenv("SHOP_LIST_CACHE_SIZE", "256"))  # list pages
+
+# Response compression: brotli (when installed) or gzip, for bodies of at least COMPRESSION_MIN_SIZE bytes
+COMPRESSION_MIN_SIZE = int(os.getenv("SHOP_COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("SHOP_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("SHOP_BROTLI_QUALITY", "4"))  # 0-11; higher is smaller but much slower
+
+# Diagnostics
+SLOW_QUERY_MS = float(os.getenv("SHOP_SLOW_QUERY_MS", "0"))  # log statements slower than this, 0 = off
+ADMIN_TOKEN = os.getenv("SHOP_ADMIN_TOKEN")  # /admin/* is disabled unless set, then needs the X-Admin-Token header
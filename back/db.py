@@ -0,0 +1,245 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter
+
+import config
+from metrics import POOL_WAIT, WRITE_BATCH_SIZE, WRITE_BATCH_DURATION, TimedConnection
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Pool of long-lived SQLite connections shared by all requests
+class ConnectionPool:
+    def __init__(self, path=config.DATABASE_PATH, size=config.POOL_SIZE, timeout=config.POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # LIFO keeps the most recently used (warmest) connection in play
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _connect(self):
+        # isolation_level=None: no implicit transactions, writes open their own with BEGIN IMMEDIATE
+        connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256,
+                                     isolation_level=None, factory=TimedConnection)
+        connection.execute(f"PRAGMA journal_mode = {config.JOURNAL_MODE};")
+        connection.execute(f"PRAGMA synchronous = {config.SYNCHRONOUS};")
+        connection.execute(f"PRAGMA cache_size = {config.CACHE_SIZE};")
+        connection.execute(f"PRAGMA mmap_size = {config.MMAP_SIZE};")
+        connection.execute(f"PRAGMA busy_timeout = {config.BUSY_TIMEOUT};")
+        connection.execute("PRAGMA foreign_keys = ON;")
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    # A connection is healthy if it can still run a trivial statement
+    def _is_healthy(self, connection):
+        try:
+            connection.execute("SELECT 1;").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @property
+    def in_use(self):
+        return self._created - self._idle.qsize()
+
+    @property
+    def idle(self):
+        return self._idle.qsize()
+
+    def acquire(self):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        start = perf_counter()
+        try:
+            return self._acquire()
+        finally:
+            POOL_WAIT.observe(perf_counter() - start)
+
+    def _acquire(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    connection = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+            if self._is_healthy(connection):
+                return connection
+            self._discard(connection)
+
+    def release(self, connection):
+        if self._closed:
+            self._discard(connection)
+            return
+        if connection.in_transaction:
+            try:
+                connection.rollback()
+            except sqlite3.Error:
+                self._discard(connection)
+                return
+        self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    # Close every idle connection; connections still in use are closed when released
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+
+
+# Async access to the pool: queries run on a bounded thread pool so the event loop never blocks.
+# Reads run in parallel up to read_concurrency. Writes go through a queue to a single writer
+# that commits everything pending as one transaction (group commit); see write().
+class Database:
+    def __init__(self, pool, read_concurrency=config.READ_CONCURRENCY,
+                 write_batch_size=config.WRITE_BATCH_SIZE, write_max_wait=config.WRITE_MAX_WAIT_MS / 1000):
+        self.pool = pool
+        self.read_concurrency = read_concurrency
+        self.write_batch_size = write_batch_size
+        self.write_max_wait = write_max_wait
+        # one worker per reader plus one for the writer
+        self._executor = ThreadPoolExecutor(max_workers=read_concurrency + 1, thread_name_prefix="db")
+        self._readers = asyncio.Semaphore(read_concurrency)
+        self._writes = asyncio.Queue()
+        self._writer = None
+
+    def _read(self, fn, args):
+        with self.pool.connection() as connection:
+            return fn(connection, *args)
+
+    # Run a batch of writes in one transaction. Each write gets its own savepoint, so a write that
+    # raises is undone on its own and the rest of the batch still commits.
+    def _write_batch(self, batch):
+        start = perf_counter()
+        with self.pool.connection() as connection:
+            results = []
+            try:
+                connection.execute("BEGIN IMMEDIATE;")
+                for fn, args, _ in batch:
+                    connection.execute("SAVEPOINT write_op;")
+                    try:
+                        value = fn(connection, *args)
+                    except Exception as e:
+                        connection.execute("ROLLBACK TO write_op;")
+                        connection.execute("RELEASE write_op;")
+                        results.append((False, e))
+                    else:
+                        connection.execute("RELEASE write_op;")
+                        results.append((True, value))
+                connection.commit()
+            except Exception as e:
+                # BEGIN or COMMIT failed (e.g. locked by another process): the whole batch fails
+                if connection.in_transaction:
+                    connection.rollback()
+                results = [(False, e)] * len(batch)
+        WRITE_BATCH_SIZE.observe(len(batch))
+        WRITE_BATCH_DURATION.observe(perf_counter() - start)
+        return results
+
+    async def _take_batch(self):
+        first = await self._writes.get()
+        if first is None:
+            return None
+        batch = [first]
+        # Everything already queued joins the batch; optionally wait a little for more
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.write_max_wait
+        while len(batch) < self.write_batch_size:
+            try:
+                item = self._writes.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._writes.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                self._writes.put_nowait(None)  # finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    async def _run_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._take_batch()
+            if batch is None:
+                return
+            # Callers that gave up (request cancelled) are skipped
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self._executor, self._write_batch, batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    # Run fn(connection, *args) on a pooled connection
+    async def read(self, fn, *args):
+        async with self._readers:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._read, fn, args)
+
+    # Run fn(connection, *args) inside a write transaction and return its result. If fn raises,
+    # only its own changes are rolled back and the exception is raised here.
+    async def write(self, fn, *args):
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._run_writer())
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait((fn, args, future))
+        return await future
+
+    # Finish the queued writes, then release the executor and the pool
+    async def close(self):
+        if self._writer is not None:
+            self._writes.put_nowait(None)
+            await self._writer
+        self._executor.shutdown(wait=True)
+        self.pool.close()
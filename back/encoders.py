@@ -0,0 +1,32 @@
+import json
+
+# Fast JSON encoding for rows that come straight from SQLite. The columns are already typed by the
+# schema, so list endpoints skip building (and FastAPI re-validating) one pydantic model per row.
+# orjson is used when installed; the standard library is the fallback.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PRODUCT_COLUMNS = ("id", "name", "price", "quantity")
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value)
+else:
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+
+def row_to_json(row, columns=PRODUCT_COLUMNS):
+    return dumps(dict(zip(columns, row)))
+
+
+def rows_to_json(rows, columns=PRODUCT_COLUMNS):
+    return dumps([dict(zip(columns, row)) for row in rows])
+
+
+def rows_to_ndjson(rows, columns=PRODUCT_COLUMNS):
+    return b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
@@ -1,381 +1,759 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
-import sqlite3
-
-app = FastAPI()
-
-# Database connection
-def dbconnect():
-    return sqlite3.connect('simple_shop.db')
-
-# Function to create the database and tables if they don't exist
-def initialize_database():
-    connection = sqlite3.connect('simple_shop.db')
-    cursor = connection.cursor()
-
-    # Create products table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        price REAL NOT NULL,
-        quantity INTEGER NOT NULL
-    );
-    """)
-
-    # Create customers table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS customers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL UNIQUE
-    );
-    """)
-
-    # Create orders table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER NOT NULL,
-        order_date TEXT NOT NULL,
-        status TEXT NOT NULL,
-        FOREIGN KEY (customer_id) REFERENCES customers(id)
-    );
-    """)
-
-    # Create order_items table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS order_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        quantity INTEGER NOT NULL,
-        price REAL NOT NULL,
-        FOREIGN KEY (order_id) REFERENCES orders(id),
-        FOREIGN KEY (product_id) REFERENCES products(id)
-    );
-    """)
-
-    cursor.close()
-    connection.close()
-
-@app.on_event("startup")
-async def startup_event():
-    initialize_database()
-
-# Pydantic models for data validation
-class Product(BaseModel):
-    id: int
-    name: str
-    price: float
-    quantity: int
-
-class NewProduct(BaseModel):
-    name: str
-    price: float
-    quantity: int
-
-class Customer(BaseModel):
-    id: int
-    name: str
-    email: str
-
-class NewCustomer(BaseModel):
-    name: str
-    email: str
-
-class Order(BaseModel):
-    id: int
-    customer_id: int
-    order_date: str
-    status: str
-
-class NewOrder(BaseModel):
-    customer_id: int
-    status: str
-
-class OrderItem(BaseModel):
-    id: int
-    order_id: int
-    product_id: int
-    quantity: int
-    price: float
-
-class NewOrderItem(BaseModel):
-    order_id: int
-    product_id: int
-    quantity: int
-
-@app.post("/products/", response_model=Product)
-async def create_product(product: NewProduct):
-    connection = dbconnect()
-    cursor = connection.cursor()
-    cursor.execute("INSERT INTO products (name, price, quantity) VALUES (?, ?, ?);",
-                   (product.name, product.price, product.quantity))
-    connection.commit()
-    cursor.execute("SELECT id FROM products WHERE name = ?;", (product.name,))
-    product_id = cursor.fetchone()[0]  # Fetching the id directly (sqlite3 returns a tuple)
-    cursor.close()
-    connection.close()
-    return Product(id=product_id, name=product.name, price=product.price, quantity=product.quantity)
-
-@app.get("/products/", response_model=List[Product])
-async def get_all_products():
-    connection = dbconnect()
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM products;")
-    products = cursor.fetchall()  # Returns a list of tuples
-    cursor.close()
-    connection.close()
-    return [Product(id=p[0], name=p[1], price=p[2], quantity=p[3]) for p in products]  # Accessing by index
-
-@app.get("/products/{product_id}", response_model=Product)
-async def get_product_by_id(product_id: int):
-    connection = dbconnect()
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM products WHERE id = ?;", (product_id,))
-    product = cursor.fetchone()  # Returns a tuple
-    cursor.close()
-    connection.close()
-    if product:
-        return Product(id=product[0], name=product[1], price=product[2], quantity=product[3])
-    raise HTTPException(status_code=404, detail="Product not found")
-
-@app.put("/products/{product_id}", response_model=Product)
-async def update_product(product_id: int, product: NewProduct):
-    connection = dbconnect() 
-    cursor = connection.cursor()
-    cursor.execute("""UPDATE products SET name = ?, price = ?, quantity = ? WHERE id = ?;""", 
-                   (product.name, product.price, product.quantity, product_id))
-    connection.commit()
-    cursor.execute("SELECT * FROM products WHERE id = ?;", (product_id,))
-    updated_product = cursor.fetchone()  # Returns a tuple
-    cursor.close()
-    connection.close()
-    if updated_product:
-        return Product(id=updated_product[0], name=updated_product[1], 
-                       price=updated_product[2], quantity=updated_product[3])
-    raise HTTPException(status_code=404, detail="Product not found")
-
-@app.delete("/products/{product_id}")
-async def delete_product(product_id: int):
-    connection = dbconnect()
-    cursor = connection.cursor()
-    cursor.execute("DELETE FROM products WHERE id = ?;", (product_id,))
-    connection.commit()
-    cursor.close()
-    connection.close()
-    return {"message": "Product deleted"}
-
-
-
-
-
-
-##############################################################################################################
-# 6. Create Customer
-# @app.post("/customers/", response_model=Customer)
-# async def create_customer(customer: NewCustomer):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("INSERT INTO customers (name, email) VALUES (%s, %s);",
-#                    (customer.name, customer.email))
-#     connection.commit()
-#     cursor.execute("SELECT id FROM customers WHERE email = %s;", (customer.email,))
-#     customer_id = cursor.fetchone()['id']
-#     cursor.close()
-#     connection.close()
-#     return Customer(id=customer_id, name=customer.name, email=customer.email)
-
-# # 7. Get All Customers
-# @app.get("/customers/", response_model=List[Customer])
-# async def get_all_customers():
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("SELECT * FROM customers;")
-#     customers = cursor.fetchall()
-#     cursor.close()
-#     connection.close()
-#     return [Customer(id=c['id'], name=c['name'], email=c['email']) for c in customers]
-
-# # 8. Get Customer by ID
-# @app.get("/customers/{customer_id}", response_model=Customer)
-# async def get_customer_by_id(customer_id: int):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("SELECT * FROM customers WHERE id = %s;", (customer_id,))
-#     customer = cursor.fetchone()
-#     cursor.close()
-#     connection.close()
-#     if customer:
-#         return Customer(id=customer['id'], name=customer['name'], email=customer['email'])
-#     raise HTTPException(status_code=404, detail="Customer not found")
-
-# # 9. Update Customer
-# @app.put("/customers/{customer_id}", response_model=Customer)
-# async def update_customer(customer_id: int, customer: NewCustomer):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("""
-#         UPDATE customers SET name = %s, email = %s WHERE id = %s;
-#     """, (customer.name, customer.email, customer_id))
-#     connection.commit()
-#     cursor.execute("SELECT * FROM customers WHERE id = %s;", (customer_id,))
-#     updated_customer = cursor.fetchone()
-#     cursor.close()
-#     connection.close()
-#     if updated_customer:
-#         return Customer(id=updated_customer['id'], name=updated_customer['name'],
-#                         email=updated_customer['email'])
-#     raise HTTPException(status_code=404, detail="Customer not found")
-
-# # 10. Delete Customer by ID
-# @app.delete("/customers/{customer_id}")
-# async def delete_customer(customer_id: int):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("DELETE FROM customers WHERE id = %s;", (customer_id,))
-#     connection.commit()
-#     cursor.close()
-#     connection.close()
-#     return {"message": "Customer deleted"}
-
-# # 11. Create Order
-# @app.post("/orders/", response_model=Order)
-# async def create_order(order: NewOrder):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("INSERT INTO orders (customer_id, order_date, status) VALUES (%s, NOW(), %s);",
-#                    (order.customer_id, order.status))
-#     connection.commit()
-#     cursor.execute("SELECT id FROM orders WHERE customer_id = %s AND status = %s ORDER BY order_date DESC LIMIT 1;",
-#                    (order.customer_id, order.status))
-#     order_id = cursor.fetchone()['id']
-#     cursor.close()
-#     connection.close()
-#     return Order(id=order_id, customer_id=order.customer_id, order_date='', status=order.status)
-
-# # 12. Get All Orders
-# @app.get("/orders/", response_model=List[Order])
-# async def get_all_orders():
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("SELECT * FROM orders;")
-#     orders = cursor.fetchall()
-#     cursor.close()
-#     connection.close()
-#     return [Order(id=o['id'], customer_id=o['customer_id'],
-#                   order_date=o['order_date'].strftime('%Y-%m-%d %H:%M:%S'),
-#                   status=o['status']) for o in orders]
-
-# # 13. Get Order by ID
-# @app.get("/orders/{order_id}", response_model=Order)
-# async def get_order_by_id(order_id: int):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("SELECT * FROM orders WHERE id = %s;", (order_id,))
-#     order = cursor.fetchone()
-#     cursor.close()
-#     connection.close()
-#     if order:
-#         return Order(id=order['id'], customer_id=order['customer_id'],
-#                      order_date=order['order_date'].strftime('%Y-%m-%d %H:%M:%S'), status=order['status'])
-#     raise HTTPException(status_code=404, detail="Order not found")
-
-# # 14. Update Order
-# @app.put("/orders/{order_id}", response_model=Order)
-# async def update_order(order_id: int, order: NewOrder):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("""
-#         UPDATE orders SET customer_id = %s, status = %s WHERE id = %s;
-#     """, (order.customer_id, order.status, order_id))
-#     connection.commit()
-#     cursor.execute("SELECT * FROM orders WHERE id = %s;", (order_id,))
-#     updated_order = cursor.fetchone()
-#     cursor.close()
-#     connection.close()
-#     if updated_order:
-#         return Order(id=updated_order['id'], customer_id=updated_order['customer_id'],
-#                      order_date=updated_order['order_date'].strftime('%Y-%m-%d %H:%M:%S'), status=updated_order['status'])
-#     raise HTTPException(status_code=404, detail="Order not found")
-
-# # 15. Delete Order by ID
-# @app.delete("/orders/{order_id}")
-# async def delete_order(order_id: int):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("DELETE FROM orders WHERE id = %s;", (order_id,))
-#     connection.commit()
-#     cursor.close()
-#     connection.close()
-#     return {"message": "Order deleted"}
-# # 16. Create Order Item
-# @app.post("/order-items/", response_model=OrderItem)
-# async def create_order_item(order_item: NewOrderItem):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("""
-#         INSERT INTO order_items (order_id, product_id, quantity, price)
-#         SELECT %s, %s, %s, price FROM products WHERE id = %s;
-#     """, (order_item.order_id, order_item.product_id, order_item.quantity, order_item.product_id))
-#     connection.commit()
-#     cursor.execute("SELECT id FROM order_items WHERE order_id = %s AND product_id = %s;",
-#                    (order_item.order_id, order_item.product_id))
-#     order_item_id = cursor.fetchone()['id']
-#     cursor.close()
-#     connection.close()
-#     return OrderItem(id=order_item_id, order_id=order_item.order_id, product_id=order_item.product_id,
-#                      quantity=order_item.quantity, price=order_item.price)
-
-# # 17. Get All Order Items
-# @app.get("/order-items/", response_model=List[OrderItem])
-# async def get_all_order_items():
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("SELECT * FROM order_items;")
-#     order_items = cursor.fetchall()
-#     cursor.close()
-#     connection.close()
-#     return [OrderItem(id=o['id'], order_id=o['order_id'], product_id=o['product_id'],
-#                       quantity=o['quantity'], price=o['price']) for o in order_items]
-
-# # 18. Get Order Items by Order ID
-# @app.get("/order-items/order/{order_id}", response_model=List[OrderItem])
-# async def get_order_items_by_order_id(order_id: int):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("SELECT * FROM order_items WHERE order_id = %s;", (order_id,))
-#     order_items = cursor.fetchall()
-#     cursor.close()
-#     connection.close()
-#     return [OrderItem(id=o['id'], order_id=o['order_id'], product_id=o['product_id'],
-#                       quantity=o['quantity'], price=o['price']) for o in order_items]
-
-# # 19. Get Order Items by Product ID
-# @app.get("/order-items/product/{product_id}", response_model=List[OrderItem])
-# async def get_order_items_by_product_id(product_id: int):
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("SELECT * FROM order_items WHERE product_id = %s;", (product_id,))
-#     order_items = cursor.fetchall()
-#     cursor.close()
-#     connection.close()
-#     return [OrderItem(id=o['id'], order_id=o['order_id'], product_id=o['product_id'],
-#                       quantity=o['quantity'], price=o['price']) for o in order_items]
-
-# # 20. Get Total Sales
-# @app.get("/sales/total")
-# async def get_total_sales():
-#     connection = dbconnect()
-#     cursor = connection.cursor()
-#     cursor.execute("""
-#     SELECT SUM(quantity * price) AS total_sales FROM order_items;
-#     """)
-#     total_sales = cursor.fetchone()['total_sales']
-#     cursor.close()
-#     connection.close()
-#     return {"total_sales": total_sales}
-
-
+from fastapi import FastAPI, HTTPException, Depends, Request, Query, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional
+import asyncio
+import hmac
+
+import backup
+import config
+import encoders
+from bulk import RowError, iter_rows
+from cache import CachedResponse, TTLCache
+import changes
+from compression import CompressionMiddleware
+from db import PoolTimeout
+import metrics
+import profiling
+from storage import ConflictError, NotFoundError, Storage, create_storage, get_storage
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware)  # innermost, so the metrics include compression time
+app.add_middleware(metrics.MetricsMiddleware)
+profiler = profiling.RequestProfiler()
+app.add_middleware(profiling.ProfilingMiddleware, profiler=profiler)
+
+# Read caches for products, kept in step with the write endpoints below
+product_cache = TTLCache(config.PRODUCT_CACHE_SIZE, config.CACHE_TTL)  # product id -> CachedResponse
+list_cache = TTLCache(config.LIST_CACHE_SIZE, config.CACHE_TTL)  # (after_id, limit, columns) -> CachedResponse
+
+# Wakes the WebSocket change feeds after product writes
+change_feed = changes.ChangeFeed()
+
+# Called after every product write: drop the cached product and every cached list page whose id
+# range contains it, and wake the change feeds
+def invalidate_products(product_ids):
+    product_ids = list(product_ids)
+    for product_id in product_ids:
+        product_cache.invalidate(product_id)
+    list_cache.invalidate_where(lambda key, page: any(
+        key[0] < product_id and (page.upper is None or product_id <= page.upper) for product_id in product_ids))
+    change_feed.notify()
+
+# Online snapshots of the database (see backup.py), one at a time per worker
+backup_job = backup.BackupJob()
+
+# Start a snapshot every config.BACKUP_INTERVAL seconds; with several workers, run
+# `python backup.py run` from cron instead so only one process takes them
+async def schedule_backups(path):
+    while True:
+        await asyncio.sleep(config.BACKUP_INTERVAL)
+        backup_job.start(path)
+
+# Writes made by other workers (or any other connection) never pass through invalidate_products
+# here, so the product change log is polled and every product changed since the last poll is
+# dropped from the caches; cached entries are at most CACHE_SYNC_SECONDS behind other writers.
+async def sync_product_caches(store):
+    version = await store.product_changes_version()
+    while True:
+        await asyncio.sleep(config.CACHE_SYNC_SECONDS)
+        try:
+            rows = await store.list_product_changes(version, config.CHANGES_PAGE_SIZE + 1)
+            if len(rows) > config.CHANGES_PAGE_SIZE:
+                product_cache.clear()
+                list_cache.clear()
+                version = await store.product_changes_version()
+            elif rows:
+                invalidate_products(row[1] for row in rows)
+                version = rows[-1][0]
+        except PoolTimeout:
+            pass  # try again at the next poll
+
+# The storage engine is picked by SHOP_STORAGE (see storage.py)
+@app.on_event("startup")
+async def startup_event():
+    app.state.storage = create_storage()
+    await app.state.storage.open()
+    app.state.cache_sync_task = None
+    if config.CACHE_TTL > 0:
+        app.state.cache_sync_task = asyncio.create_task(sync_product_caches(app.state.storage))
+    app.state.backup_task = None
+    if config.BACKUP_INTERVAL > 0 and getattr(app.state.storage, "path", None):
+        app.state.backup_task = asyncio.create_task(schedule_backups(app.state.storage.path))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (app.state.cache_sync_task, app.state.backup_task):
+        if task is not None:
+            task.cancel()
+    backup_job.cancel()
+    await app.state.storage.close()
+
+# Pool and cache gauges, read when /metrics is scraped (pool gauges are empty for the memory engine)
+metrics.Gauge("db_pool_size", "Maximum pooled connections", lambda: app.state.storage.db.pool.size)
+metrics.Gauge("db_pool_connections_in_use", "Pooled connections checked out",
+              lambda: app.state.storage.db.pool.in_use)
+metrics.Gauge("db_pool_connections_idle", "Pooled connections ready for use",
+              lambda: app.state.storage.db.pool.idle)
+metrics.Gauge("product_cache_hits", "Product cache hits", lambda: product_cache.hits)
+metrics.Gauge("product_cache_misses", "Product cache misses", lambda: product_cache.misses)
+metrics.Gauge("list_cache_hits", "Product list cache hits", lambda: list_cache.hits)
+metrics.Gauge("list_cache_misses", "Product list cache misses", lambda: list_cache.misses)
+metrics.Gauge("backup_last_success_timestamp_seconds", "Unix time of the last successful snapshot",
+              lambda: backup_job.last_success or 0)
+metrics.Gauge("change_feed_subscribers", "Open product change feed WebSockets", lambda: change_feed.subscribers)
+
+# Prometheus text exposition format
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Admin endpoints are disabled unless SHOP_ADMIN_TOKEN is set, and then require it in X-Admin-Token
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set SHOP_ADMIN_TOKEN)")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Profile the next N requests; GET /admin/profile returns the aggregated cProfile report
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profiling(requests: int = Query(100, ge=1, le=100_000)):
+    if not profiler.arm(requests):
+        raise HTTPException(status_code=409, detail="Profiled requests are still in flight, try again")
+    return {"message": f"Profiling the next {requests} requests"}
+
+@app.get("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def get_profile_report(limit: int = Query(40, ge=1, le=1000),
+                             sort: str = Query("cumulative", pattern="^(cumulative|tottime|ncalls)$")):
+    return PlainTextResponse(profiler.report(limit, sort))
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def stop_profiling():
+    profiler.reset()
+    return {"message": "Profiling stopped"}
+
+# Start an online snapshot of the database in the background; GET /admin/backup reports its progress
+@app.post("/admin/backup", status_code=202, dependencies=[Depends(require_admin)])
+async def start_backup(store: Storage = Depends(get_storage)):
+    path = getattr(store, "path", None)
+    if path is None:
+        raise HTTPException(status_code=409, detail="Backups need the sqlite storage engine")
+    if not backup_job.start(path):
+        raise HTTPException(status_code=409, detail="A backup is already running")
+    return backup_job.status()
+
+@app.get("/admin/backup", dependencies=[Depends(require_admin)])
+async def get_backup_status():
+    return backup_job.status()
+
+# All pooled connections are busy for longer than the pool timeout
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": "Database busy, try again later"})
+
+# Storage errors map to the matching HTTP status
+@app.exception_handler(NotFoundError)
+async def not_found_handler(request: Request, exc: NotFoundError):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+@app.exception_handler(ConflictError)
+async def conflict_handler(request: Request, exc: ConflictError):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+# Pydantic models for data validation
+class Product(BaseModel):
+    id: int
+    name: str
+    price: float
+    quantity: int
+
+class NewProduct(BaseModel):
+    name: str
+    price: float
+    quantity: int
+
+# Body of the batch lookup endpoints (POST /products/lookup, /orders/lookup)
+class IdLookup(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=config.MAX_LOOKUP_IDS)
+
+class ProductLookupResult(BaseModel):
+    products: List[Product]  # in request order
+    missing: List[int]
+
+class BulkProduct(NewProduct):
+    id: Optional[int] = None  # rows with an id are upserted, rows without are inserted
+
+class BulkRowError(BaseModel):
+    row: int
+    detail: str
+
+class BulkResult(BaseModel):
+    received: int
+    written: int
+    ids: List[Optional[int]]  # id per input row, null where the row failed
+    errors: List[BulkRowError]
+
+class ProductChange(BaseModel):
+    version: int
+    id: int
+    deleted: bool
+    name: Optional[str] = None  # name, price and quantity are left out for deleted products
+    price: Optional[float] = None
+    quantity: Optional[int] = None
+
+class ProductChanges(BaseModel):
+    version: int  # pass as ?since= on the next call
+    has_more: bool
+    changes: List[ProductChange]
+
+class Customer(BaseModel):
+    id: int
+    name: str
+    email: str
+
+class NewCustomer(BaseModel):
+    name: str
+    email: str
+
+class CustomerLookup(BaseModel):
+    ids: List[int] = Field([], max_length=config.MAX_LOOKUP_IDS)
+    emails: List[str] = Field([], max_length=config.MAX_LOOKUP_IDS)
+
+class CustomerLookupResult(BaseModel):
+    customers: List[Customer]  # matches for ids, then for emails, each in request order
+    missing_ids: List[int]
+    missing_emails: List[str]
+
+class Order(BaseModel):
+    id: int
+    customer_id: int
+    order_date: str
+    status: str
+
+class NewOrder(BaseModel):
+    customer_id: int
+    status: str
+
+class OrderItem(BaseModel):
+    id: int
+    order_id: int
+    product_id: int
+    quantity: int
+    price: float
+
+class NewOrderItem(BaseModel):
+    order_id: int
+    product_id: int
+    quantity: int
+
+class SalesSummary(BaseModel):
+    total_sales: float
+    items_sold: int
+
+class DailySales(BaseModel):
+    day: str
+    total_sales: float
+    items_sold: int
+
+class OrderLine(BaseModel):
+    product_id: int
+    quantity: int = Field(gt=0)
+
+class NewCheckout(BaseModel):
+    customer_id: int
+    status: str = "placed"
+    items: List[OrderLine] = Field(min_length=1)
+
+class PlacedOrder(BaseModel):
+    id: int
+    customer_id: int
+    order_date: str
+    status: str
+    items: List[OrderItem]
+    total: float
+
+class OrderLineDetail(BaseModel):
+    id: int
+    product_id: int
+    product_name: Optional[str]  # None once the product is deleted (possible for archived orders)
+    quantity: int
+    price: float
+    line_total: float
+
+class OrderDetail(BaseModel):
+    id: int
+    customer_id: int
+    order_date: str
+    status: str
+    items: List[OrderLineDetail]
+    items_sold: int
+    total: float
+
+class OrderLookupResult(BaseModel):
+    orders: List[OrderDetail]  # in request order
+    missing: List[int]
+
+@app.post("/products/", response_model=Product)
+async def create_product(product: NewProduct, store: Storage = Depends(get_storage)):
+    new_product = await store.create_product(product.name, product.price, product.quantity)
+    invalidate_products([new_product[0]])
+    return Product(id=new_product[0], name=new_product[1], price=new_product[2], quantity=new_product[3])
+
+# ?fields=name,price projection for product listings, pushed down into the SELECT list. id is always
+# included (it is the paging cursor); columns come back in their usual order.
+def product_fields(fields: Optional[str] = Query(None, description="comma-separated subset of id,name,price,quantity")):
+    if fields is None:
+        return encoders.PRODUCT_COLUMNS
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested.difference(encoders.PRODUCT_COLUMNS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(column for column in encoders.PRODUCT_COLUMNS if column == "id" or column in requested)
+
+# Stream products as NDJSON, one keyset chunk at a time, so memory stays flat for any table size
+async def stream_products(store, after_id, limit, columns):
+    remaining = limit
+    while remaining is None or remaining > 0:
+        chunk_size = config.STREAM_CHUNK_SIZE if remaining is None else min(remaining, config.STREAM_CHUNK_SIZE)
+        products = await store.list_products(after_id, chunk_size, columns)
+        if not products:
+            break
+        yield encoders.rows_to_ndjson(products, columns)
+        after_id = products[-1][0]
+        if remaining is not None:
+            remaining -= len(products)
+        if len(products) < chunk_size:
+            break
+
+# Without limit the whole catalog is returned (as before). With limit, one page is returned and the
+# X-Next-After-Id header holds the cursor for the next page. Ask for NDJSON (?stream=true or
+# Accept: application/x-ndjson) to stream the rows instead of building the list in memory.
+# ?fields= trims the columns (see product_fields).
+@app.get("/products/", response_model=List[Product])
+async def get_all_products(request: Request,
+                           after_id: int = Query(0, ge=0),
+                           limit: Optional[int] = Query(None, ge=1, le=config.MAX_PAGE_SIZE),
+                           stream: bool = False,
+                           columns: tuple = Depends(product_fields),
+                           store: Storage = Depends(get_storage)):
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(stream_products(store, after_id, limit, columns), media_type="application/x-ndjson")
+    # Unpaginated lists are only cached from the start: every other after_id would hold most of
+    # the catalog in a cache that is bounded by entry count
+    cacheable = limit is not None or after_id == 0
+    key = (after_id, limit, columns)
+    page = list_cache.get(key) if cacheable else None
+    if page is None:
+        generation = list_cache.generation
+        headers, upper = {}, None
+        products = await store.list_products(after_id, limit, columns)
+        if limit is not None and len(products) == limit:
+            headers["X-Next-After-Id"] = str(products[-1][0])
+            upper = products[-1][0]  # a full page only changes when ids up to its last row change
+        # Rows are encoded directly; response_model still documents the shape
+        page = CachedResponse(encoders.rows_to_json(products, columns), headers=headers, upper=upper)
+        if cacheable:
+            list_cache.put(key, page, generation)
+    return page.to_response(request)
+
+# Bulk import: body is a JSON array, NDJSON (application/x-ndjson) or CSV (text/csv, header row
+# with name,price,quantity and an optional id). Rows are validated and written in chunks of
+# BULK_CHUNK_SIZE, each chunk in its own transaction (executemany on SQLite).
+@app.post("/products/bulk", response_model=BulkResult)
+async def bulk_import_products(request: Request, store: Storage = Depends(get_storage)):
+    ids, errors = [], []
+    chunk = []
+
+    async def flush():
+        chunk_ids, chunk_errors = await store.write_products(chunk)
+        invalidate_products(chunk_ids.values())
+        for row in chunk:
+            ids[row[0]] = chunk_ids.get(row[0])
+        errors.extend(BulkRowError(row=index, detail=detail) for index, detail in chunk_errors.items())
+        chunk.clear()
+
+    try:
+        async for row in iter_rows(request):
+            index = len(ids)
+            ids.append(None)
+            if isinstance(row, RowError):
+                errors.append(BulkRowError(row=index, detail=str(row)))
+                continue
+            try:
+                product = BulkProduct.model_validate(row)
+            except ValidationError as e:
+                errors.append(BulkRowError(row=index, detail="; ".join(
+                    f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())))
+                continue
+            chunk.append((index, product.id, product.name, product.price, product.quantity))
+            if len(chunk) >= config.BULK_CHUNK_SIZE:
+                await flush()
+    except RowError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if chunk:
+        await flush()
+    errors.sort(key=lambda e: e.row)
+    return BulkResult(received=len(ids), written=sum(i is not None for i in ids), ids=ids, errors=errors)
+
+# Delta sync: the latest change of every product changed after version `since`, oldest first.
+# Start from since=0 (every product), then keep passing back the returned version.
+@app.get("/products/changes", response_model=ProductChanges)
+async def get_product_changes(since: int = Query(0, ge=0),
+                              limit: int = Query(config.CHANGES_PAGE_SIZE, ge=1, le=config.CHANGES_PAGE_SIZE),
+                              store: Storage = Depends(get_storage)):
+    rows = await store.list_product_changes(since, limit + 1)
+    return Response(changes.changes_to_json(rows[:limit], since, len(rows) > limit), media_type="application/json")
+
+async def wait_for_disconnect(websocket):
+    try:
+        while True:
+            await websocket.receive_text()  # clients have nothing to say; anything they send is ignored
+    except WebSocketDisconnect:
+        pass
+
+# Change feed: sends the changes after `since` (in pages shaped like GET /products/changes), then a
+# message for every later commit. Clients keep the last version they saw and reconnect with it.
+@app.websocket("/products/changes/ws")
+async def product_change_feed(websocket: WebSocket, since: int = Query(0, ge=0),
+                              store: Storage = Depends(get_storage)):
+    await websocket.accept()
+    wake = change_feed.subscribe()
+    disconnected = asyncio.create_task(wait_for_disconnect(websocket))
+    try:
+        while not disconnected.done():
+            wake.clear()  # before reading, so a commit landing during the read wakes us again
+            rows = await store.list_product_changes(since, config.CHANGES_PAGE_SIZE + 1)
+            if rows:
+                page = rows[:config.CHANGES_PAGE_SIZE]
+                await websocket.send_text(changes.changes_to_json(page, since, len(rows) > len(page)).decode())
+                since = page[-1][0]
+                if len(rows) > len(page):
+                    continue
+            woken = asyncio.create_task(wake.wait())
+            await asyncio.wait({disconnected, woken}, timeout=config.CHANGE_FEED_POLL_SECONDS,
+                               return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        change_feed.unsubscribe(wake)
+        disconnected.cancel()
+
+# Search product names: every word must match, as a word prefix unless prefix=false (autocomplete)
+@app.get("/products/search", response_model=List[Product])
+async def search_products(q: str = Query(min_length=1, max_length=200),
+                          limit: int = Query(config.SEARCH_PAGE_SIZE, ge=1, le=config.MAX_PAGE_SIZE),
+                          prefix: bool = True,
+                          store: Storage = Depends(get_storage)):
+    products = await store.search_products(q, limit, prefix)
+    return Response(encoders.rows_to_json(products), media_type="application/json")
+
+# Many products in one round trip (a cart, an invoice): found products in request order plus the
+# ids that do not exist
+@app.post("/products/lookup", response_model=ProductLookupResult)
+async def lookup_products(lookup: IdLookup, store: Storage = Depends(get_storage)):
+    products = await store.get_products(lookup.ids)
+    found = [products[i] for i in lookup.ids if i in products]
+    body = encoders.dumps({"products": [dict(zip(encoders.PRODUCT_COLUMNS, row)) for row in found],
+                           "missing": [i for i in lookup.ids if i not in products]})
+    return Response(body, media_type="application/json")
+
+@app.get("/products/{product_id}", response_model=Product)
+async def get_product_by_id(product_id: int, request: Request, store: Storage = Depends(get_storage)):
+    cached = product_cache.get(product_id)
+    if cached is None:
+        generation = product_cache.generation
+        product = await store.get_product(product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        cached = CachedResponse(encoders.row_to_json(product))
+        product_cache.put(product_id, cached, generation)
+    return cached.to_response(request)
+
+@app.put("/products/{product_id}", response_model=Product)
+async def update_product(product_id: int, product: NewProduct, store: Storage = Depends(get_storage)):
+    updated_product = await store.update_product(product_id, product.name, product.price, product.quantity)
+    invalidate_products([product_id])
+    if updated_product:
+        return Product(id=updated_product[0], name=updated_product[1],
+                       price=updated_product[2], quantity=updated_product[3])
+    raise HTTPException(status_code=404, detail="Product not found")
+
+@app.delete("/products/{product_id}")
+async def delete_product(product_id: int, store: Storage = Depends(get_storage)):
+    await store.delete_product(product_id)
+    invalidate_products([product_id])
+    return {"message": "Product deleted"}
+
+@app.post("/orders/checkout", response_model=PlacedOrder)
+async def checkout(checkout: NewCheckout, store: Storage = Depends(get_storage)):
+    # Merge repeated products into one line
+    quantities = {}
+    for line in checkout.items:
+        quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+    order, items = await store.place_order(checkout.customer_id, checkout.status, quantities)
+    invalidate_products([item[2] for item in items])  # stock changed
+    order_items = [OrderItem(id=i[0], order_id=i[1], product_id=i[2], quantity=i[3], price=i[4]) for i in items]
+    return PlacedOrder(id=order[0], customer_id=order[1], order_date=order[2], status=order[3], items=order_items,
+                       total=sum(i.quantity * i.price for i in order_items))
+
+def order_detail(order, lines):
+    items = [OrderLineDetail(id=l[0], product_id=l[1], product_name=l[2], quantity=l[3], price=l[4],
+                             line_total=l[3] * l[4]) for l in lines]
+    return OrderDetail(id=order[0], customer_id=order[1], order_date=order[2], status=order[3], items=items,
+                       items_sold=sum(i.quantity for i in items), total=sum(i.line_total for i in items))
+
+# An order with its lines, product names and totals, read in one query
+@app.get("/orders/{order_id}", response_model=OrderDetail)
+async def get_order_detail(order_id: int, store: Storage = Depends(get_storage)):
+    details = await store.get_order_details([order_id])
+    if order_id not in details:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order_detail(*details[order_id])
+
+# Many orders in one round trip, e.g. a page of a back-office order list
+@app.post("/orders/lookup", response_model=OrderLookupResult)
+async def lookup_orders(lookup: IdLookup, store: Storage = Depends(get_storage)):
+    details = await store.get_order_details(lookup.ids)
+    return OrderLookupResult(orders=[order_detail(*details[i]) for i in lookup.ids if i in details],
+                             missing=[i for i in lookup.ids if i not in details])
+
+# Customers by id and/or by email in one round trip
+@app.post("/customers/lookup", response_model=CustomerLookupResult)
+async def lookup_customers(lookup: CustomerLookup, store: Storage = Depends(get_storage)):
+    if not lookup.ids and not lookup.emails:
+        raise HTTPException(status_code=422, detail="Give ids, emails or both")
+    by_id = await store.get_customers(lookup.ids) if lookup.ids else {}
+    by_email = await store.get_customers_by_email(lookup.emails) if lookup.emails else {}
+    found = [by_id[i] for i in lookup.ids if i in by_id] + [by_email[e] for e in lookup.emails if e in by_email]
+    return CustomerLookupResult(customers=[Customer(id=c[0], name=c[1], email=c[2]) for c in found],
+                                missing_ids=[i for i in lookup.ids if i not in by_id],
+                                missing_emails=[e for e in lookup.emails if e not in by_email])
+
+# A customer's order history, newest first. X-Next-Before-Id holds the cursor for the next page.
+@app.get("/customers/{customer_id}/orders", response_model=List[OrderDetail])
+async def get_customer_orders(customer_id: int, response: Response,
+                              before_id: Optional[int] = Query(None, ge=1),
+                              limit: int = Query(50, ge=1, le=config.MAX_PAGE_SIZE),
+                              store: Storage = Depends(get_storage)):
+    orders = await store.list_customer_orders(customer_id, before_id, limit)
+    if not orders and await store.get_customer(customer_id) is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    if len(orders) == limit:
+        response.headers["X-Next-Before-Id"] = str(orders[-1][0][0])
+    return [order_detail(order, lines) for order, lines in orders]
+
+# Sales figures come from rollups kept up to date on every order (see sales.py)
+@app.get("/sales/total", response_model=SalesSummary)
+async def get_total_sales(store: Storage = Depends(get_storage)):
+    total, quantity = await store.sales_total()
+    return SalesSummary(total_sales=total, items_sold=quantity)
+
+@app.get("/sales/products/{product_id}", response_model=SalesSummary)
+async def get_product_sales(product_id: int, store: Storage = Depends(get_storage)):
+    total, quantity = await store.product_sales(product_id)
+    return SalesSummary(total_sales=total, items_sold=quantity)
+
+@app.get("/sales/customers/{customer_id}", response_model=SalesSummary)
+async def get_customer_sales(customer_id: int, store: Storage = Depends(get_storage)):
+    total, quantity = await store.customer_sales(customer_id)
+    return SalesSummary(total_sales=total, items_sold=quantity)
+
+# Days are YYYY-MM-DD (UTC, as stored in orders.order_date)
+@app.get("/sales/daily", response_model=List[DailySales])
+async def get_daily_sales(start: str = Query("0000-00-00", pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                          end: str = Query("9999-99-99", pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                          store: Storage = Depends(get_storage)):
+    days = await store.daily_sales(start, end)
+    return [DailySales(day=d[0], total_sales=d[1], items_sold=d[2]) for d in days]
+
+
+
+
+
+##############################################################################################################
+# 6. Create Customer
+# @app.post("/customers/", response_model=Customer)
+# async def create_customer(customer: NewCustomer):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("INSERT INTO customers (name, email) VALUES (%s, %s) RETURNING id;",
+#                    (customer.name, customer.email))
+#     customer_id = cursor.fetchone()['id']
+#     connection.commit()
+#     cursor.close()
+#     connection.close()
+#     return Customer(id=customer_id, name=customer.name, email=customer.email)
+
+# # 7. Get All Customers
+# @app.get("/customers/", response_model=List[Customer])
+# async def get_all_customers():
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("SELECT * FROM customers;")
+#     customers = cursor.fetchall()
+#     cursor.close()
+#     connection.close()
+#     return [Customer(id=c['id'], name=c['name'], email=c['email']) for c in customers]
+
+# # 8. Get Customer by ID
+# @app.get("/customers/{customer_id}", response_model=Customer)
+# async def get_customer_by_id(customer_id: int):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("SELECT * FROM customers WHERE id = %s;", (customer_id,))
+#     customer = cursor.fetchone()
+#     cursor.close()
+#     connection.close()
+#     if customer:
+#         return Customer(id=customer['id'], name=customer['name'], email=customer['email'])
+#     raise HTTPException(status_code=404, detail="Customer not found")
+
+# # 9. Update Customer
+# @app.put("/customers/{customer_id}", response_model=Customer)
+# async def update_customer(customer_id: int, customer: NewCustomer):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("""
+#         UPDATE customers SET name = %s, email = %s WHERE id = %s;
+#     """, (customer.name, customer.email, customer_id))
+#     connection.commit()
+#     cursor.execute("SELECT * FROM customers WHERE id = %s;", (customer_id,))
+#     updated_customer = cursor.fetchone()
+#     cursor.close()
+#     connection.close()
+#     if updated_customer:
+#         return Customer(id=updated_customer['id'], name=updated_customer['name'],
+#                         email=updated_customer['email'])
+#     raise HTTPException(status_code=404, detail="Customer not found")
+
+# # 10. Delete Customer by ID
+# @app.delete("/customers/{customer_id}")
+# async def delete_customer(customer_id: int):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("DELETE FROM customers WHERE id = %s;", (customer_id,))
+#     connection.commit()
+#     cursor.close()
+#     connection.close()
+#     return {"message": "Customer deleted"}
+
+# # 11. Create Order
+# @app.post("/orders/", response_model=Order)
+# async def create_order(order: NewOrder):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("INSERT INTO orders (customer_id, order_date, status) VALUES (%s, NOW(), %s) RETURNING id;",
+#                    (order.customer_id, order.status))
+#     order_id = cursor.fetchone()['id']
+#     connection.commit()
+#     cursor.close()
+#     connection.close()
+#     return Order(id=order_id, customer_id=order.customer_id, order_date='', status=order.status)
+
+# # 12. Get All Orders
+# @app.get("/orders/", response_model=List[Order])
+# async def get_all_orders():
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("SELECT * FROM orders;")
+#     orders = cursor.fetchall()
+#     cursor.close()
+#     connection.close()
+#     return [Order(id=o['id'], customer_id=o['customer_id'],
+#                   order_date=o['order_date'].strftime('%Y-%m-%d %H:%M:%S'),
+#                   status=o['status']) for o in orders]
+
+# # 13. Get Order by ID
+# @app.get("/orders/{order_id}", response_model=Order)
+# async def get_order_by_id(order_id: int):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("SELECT * FROM orders WHERE id = %s;", (order_id,))
+#     order = cursor.fetchone()
+#     cursor.close()
+#     connection.close()
+#     if order:
+#         return Order(id=order['id'], customer_id=order['customer_id'],
+#                      order_date=order['order_date'].strftime('%Y-%m-%d %H:%M:%S'), status=order['status'])
+#     raise HTTPException(status_code=404, detail="Order not found")
+
+# # 14. Update Order
+# @app.put("/orders/{order_id}", response_model=Order)
+# async def update_order(order_id: int, order: NewOrder):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("""
+#         UPDATE orders SET customer_id = %s, status = %s WHERE id = %s;
+#     """, (order.customer_id, order.status, order_id))
+#     connection.commit()
+#     cursor.execute("SELECT * FROM orders WHERE id = %s;", (order_id,))
+#     updated_order = cursor.fetchone()
+#     cursor.close()
+#     connection.close()
+#     if updated_order:
+#         return Order(id=updated_order['id'], customer_id=updated_order['customer_id'],
+#                      order_date=updated_order['order_date'].strftime('%Y-%m-%d %H:%M:%S'), status=updated_order['status'])
+#     raise HTTPException(status_code=404, detail="Order not found")
+
+# # 15. Delete Order by ID
+# @app.delete("/orders/{order_id}")
+# async def delete_order(order_id: int):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("DELETE FROM orders WHERE id = %s;", (order_id,))
+#     connection.commit()
+#     cursor.close()
+#     connection.close()
+#     return {"message": "Order deleted"}
+# # 16. Create Order Item
+# @app.post("/order-items/", response_model=OrderItem)
+# async def create_order_item(order_item: NewOrderItem):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("""
+#         INSERT INTO order_items (order_id, product_id, quantity, price)
+#         SELECT %s, %s, %s, price FROM products WHERE id = %s RETURNING id, price;
+#     """, (order_item.order_id, order_item.product_id, order_item.quantity, order_item.product_id))
+#     order_item_id, price = cursor.fetchone()
+#     connection.commit()
+#     cursor.close()
+#     connection.close()
+#     return OrderItem(id=order_item_id, order_id=order_item.order_id, product_id=order_item.product_id,
+#                      quantity=order_item.quantity, price=price)
+
+# # 17. Get All Order Items
+# @app.get("/order-items/", response_model=List[OrderItem])
+# async def get_all_order_items():
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("SELECT * FROM order_items;")
+#     order_items = cursor.fetchall()
+#     cursor.close()
+#     connection.close()
+#     return [OrderItem(id=o['id'], order_id=o['order_id'], product_id=o['product_id'],
+#                       quantity=o['quantity'], price=o['price']) for o in order_items]
+
+# # 18. Get Order Items by Order ID
+# @app.get("/order-items/order/{order_id}", response_model=List[OrderItem])
+# async def get_order_items_by_order_id(order_id: int):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("SELECT * FROM order_items WHERE order_id = %s;", (order_id,))
+#     order_items = cursor.fetchall()
+#     cursor.close()
+#     connection.close()
+#     return [OrderItem(id=o['id'], order_id=o['order_id'], product_id=o['product_id'],
+#                       quantity=o['quantity'], price=o['price']) for o in order_items]
+
+# # 19. Get Order Items by Product ID
+# @app.get("/order-items/product/{product_id}", response_model=List[OrderItem])
+# async def get_order_items_by_product_id(product_id: int):
+#     connection = dbconnect()
+#     cursor = connection.cursor()
+#     cursor.execute("SELECT * FROM order_items WHERE product_id = %s;", (product_id,))
+#     order_items = cursor.fetchall()
+#     cursor.close()
+#     connection.close()
+#     return [OrderItem(id=o['id'], order_id=o['order_id'], product_id=o['product_id'],
+#                       quantity=o['quantity'], price=o['price']) for o in order_items]
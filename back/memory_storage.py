@@ -0,0 +1,315 @@
+import bisect
+import sqlite3
+from datetime import datetime, timezone
+
+import search
+from encoders import PRODUCT_COLUMNS
+from storage import ConflictError, NotFoundError, Storage
+
+# In-memory storage engine: rows live in dicts keyed by id, with secondary indexes for the lookups
+# the routes make. Nothing touches the disk, which makes it suited to tests and benchmarks, and,
+# loaded from a snapshot of the SQLite database, to serving read-mostly traffic.
+#
+# Every method runs to completion on the event loop without awaiting, so each call is atomic with
+# respect to the others; no locking is needed. Ids follow AUTOINCREMENT rules (never reused).
+
+
+class MemoryStorage(Storage):
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self.products = {}  # id -> (id, name, price, quantity)
+        self.product_ids = []  # sorted, for keyset pages
+        self.name_terms = {}  # product id -> search terms of its name (see search.terms)
+        self.term_products = {}  # search term -> {product id}
+        self.sorted_terms = []  # every indexed term, sorted, for prefix matches
+        self.customers = {}  # id -> (id, name, email)
+        self.customers_by_email = {}  # email -> id
+        self.orders = {}  # id -> (id, customer_id, order_date, status)
+        self.orders_by_customer = {}  # customer id -> [order id]
+        self.order_items = {}  # id -> (id, order_id, product_id, quantity, price)
+        self.items_by_order = {}  # order id -> [item id]
+        self.items_by_product = {}  # product id -> [item id]
+        self.product_versions = {}  # product id -> version of its latest change (see changes.py)
+        self.change_versions = []  # change log in version order; entries superseded by a later change
+        self.change_products = []  # of the same product are skipped on read and dropped by compaction
+        self.last_ids = {"products": 0, "customers": 0, "orders": 0, "order_items": 0, "product_changes": 0}
+        # Sales rollups, kept up to date as orders are placed (mirrors the tables in sales.py)
+        self.sales_totals = [0, 0]
+        self.sales_by_product = {}
+        self.sales_by_customer = {}
+        self.sales_by_day = {}
+
+    async def open(self):
+        if self.snapshot_path:
+            self.load_snapshot(self.snapshot_path)
+
+    # Copy every row of a SQLite database into memory
+    def load_snapshot(self, path):
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            for row in connection.execute("SELECT id, name, price, quantity FROM products ORDER BY id;"):
+                self._put_product(row)
+            for row in connection.execute("SELECT id, name, email FROM customers;"):
+                self._put_customer(row)
+            for row in connection.execute("SELECT id, customer_id, order_date, status FROM orders ORDER BY id;"):
+                self._put_order(row)
+            for row in connection.execute("SELECT id, order_id, product_id, quantity, price FROM order_items ORDER BY id;"):
+                self._put_order_item(row)
+            # The rollups also count archived orders (see archive.py), which are not loaded
+            self._load_sales(connection)
+            for version, product_id in connection.execute(
+                    "SELECT version, product_id FROM product_changes ORDER BY version;"):
+                self.product_versions[product_id] = version
+                self.change_versions.append(version)
+                self.change_products.append(product_id)
+            for name, seq in connection.execute("SELECT name, seq FROM sqlite_sequence;"):
+                if name in self.last_ids:
+                    self.last_ids[name] = max(self.last_ids[name], seq)
+        finally:
+            connection.close()
+
+    def _next_id(self, table):
+        self.last_ids[table] += 1
+        return self.last_ids[table]
+
+    def _put_product(self, row):
+        old = self.products.get(row[0])
+        if old is None:
+            bisect.insort(self.product_ids, row[0])
+        if old is None or old[1] != row[1]:
+            self._unindex_name(row[0])
+            self._index_name(row[0], row[1])
+        self.products[row[0]] = row
+        self.last_ids["products"] = max(self.last_ids["products"], row[0])
+
+    def _index_name(self, product_id, name):
+        self.name_terms[product_id] = terms = search.terms(name)
+        for term in terms:
+            if term not in self.term_products:
+                self.term_products[term] = set()
+                bisect.insort(self.sorted_terms, term)
+            self.term_products[term].add(product_id)
+
+    def _unindex_name(self, product_id):
+        for term in self.name_terms.pop(product_id, ()):
+            products = self.term_products[term]
+            products.discard(product_id)
+            if not products:
+                del self.term_products[term]
+                del self.sorted_terms[bisect.bisect_left(self.sorted_terms, term)]
+
+    def _record_change(self, product_id):
+        version = self._next_id("product_changes")
+        self.product_versions[product_id] = version
+        self.change_versions.append(version)
+        self.change_products.append(product_id)
+        if len(self.change_versions) > 2 * len(self.product_versions) + 1024:
+            live = sorted((v, p) for p, v in self.product_versions.items())
+            self.change_versions = [v for v, p in live]
+            self.change_products = [p for v, p in live]
+
+    def _put_customer(self, row):
+        self.customers[row[0]] = row
+        self.customers_by_email[row[2]] = row[0]
+        self.last_ids["customers"] = max(self.last_ids["customers"], row[0])
+
+    def _put_order(self, row):
+        self.orders[row[0]] = row
+        self.orders_by_customer.setdefault(row[1], []).append(row[0])
+        self.last_ids["orders"] = max(self.last_ids["orders"], row[0])
+
+    def _put_order_item(self, row):
+        item_id, order_id, product_id, quantity, price = row
+        self.order_items[item_id] = row
+        self.items_by_order.setdefault(order_id, []).append(item_id)
+        self.items_by_product.setdefault(product_id, []).append(item_id)
+        self.last_ids["order_items"] = max(self.last_ids["order_items"], item_id)
+
+    def _load_sales(self, connection):
+        self.sales_totals = list(connection.execute(
+            "SELECT total, quantity FROM sales_totals WHERE id = 1;").fetchone() or (0, 0))
+        for table, column, rollup in (("sales_by_product", "product_id", self.sales_by_product),
+                                      ("sales_by_customer", "customer_id", self.sales_by_customer),
+                                      ("sales_by_day", "day", self.sales_by_day)):
+            for key, total, quantity in connection.execute(f"SELECT {column}, total, quantity FROM {table};"):
+                rollup[key] = [total, quantity]
+
+    def _add_sales(self, row):
+        item_id, order_id, product_id, quantity, price = row
+        order = self.orders[order_id]
+        amount = quantity * price
+        for rollup in (self.sales_totals, self.sales_by_product.setdefault(product_id, [0, 0]),
+                       self.sales_by_customer.setdefault(order[1], [0, 0]),
+                       self.sales_by_day.setdefault(order[2][:10], [0, 0])):
+            rollup[0] += amount
+            rollup[1] += quantity
+
+    # Products
+    async def create_product(self, name, price, quantity):
+        product = (self._next_id("products"), name, price, quantity)
+        self._put_product(product)
+        self._record_change(product[0])
+        return product
+
+    async def get_product(self, product_id):
+        return self.products.get(product_id)
+
+    async def get_products(self, product_ids):
+        return {product_id: self.products[product_id] for product_id in product_ids if product_id in self.products}
+
+    async def list_products(self, after_id=0, limit=None, columns=PRODUCT_COLUMNS):
+        start = bisect.bisect_right(self.product_ids, after_id)
+        end = None if limit is None else start + limit
+        products = [self.products[product_id] for product_id in self.product_ids[start:end]]
+        if columns != PRODUCT_COLUMNS:
+            indexes = [PRODUCT_COLUMNS.index(column) for column in columns]
+            products = [tuple(product[i] for i in indexes) for product in products]
+        return products
+
+    # Every term must match (as a word prefix with prefix). Ranking is simpler than FTS5's bm25:
+    # names with fewer words first, then by id.
+    async def search_products(self, query, limit, prefix=True):
+        words = search.terms(query)
+        if not words:
+            return []
+        matches = None
+        for word in words:
+            if prefix:
+                start = bisect.bisect_left(self.sorted_terms, word)
+                end = bisect.bisect_left(self.sorted_terms, word + "\uffff")
+                found = set().union(*(self.term_products[term] for term in self.sorted_terms[start:end]))
+            else:
+                found = self.term_products.get(word, set())
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+        ranked = sorted(matches, key=lambda product_id: (len(self.name_terms[product_id]), product_id))
+        return [self.products[product_id] for product_id in ranked[:limit]]
+
+    async def update_product(self, product_id, name, price, quantity):
+        if product_id not in self.products:
+            return None
+        product = (product_id, name, price, quantity)
+        self._put_product(product)
+        self._record_change(product_id)
+        return product
+
+    async def delete_product(self, product_id):
+        if product_id not in self.products:
+            return
+        if self.items_by_product.get(product_id):
+            raise ConflictError(f"Product {product_id} has order items")
+        del self.products[product_id]
+        del self.product_ids[bisect.bisect_left(self.product_ids, product_id)]
+        self._unindex_name(product_id)
+        self._record_change(product_id)
+
+    async def write_products(self, rows):
+        ids = {}
+        for index, product_id, name, price, quantity in rows:
+            if product_id is None:
+                product_id = self._next_id("products")
+            self._put_product((product_id, name, price, quantity))
+            self._record_change(product_id)
+            ids[index] = product_id
+        return ids, {}
+
+    async def list_product_changes(self, since, limit):
+        rows = []
+        start = bisect.bisect_right(self.change_versions, since)
+        for i in range(start, len(self.change_versions)):
+            version, product_id = self.change_versions[i], self.change_products[i]
+            if self.product_versions[product_id] != version:
+                continue
+            product = self.products.get(product_id)
+            if product is None:
+                rows.append((version, product_id, 1, None, None, None))
+            else:
+                rows.append((version, product_id, 0) + product[1:])
+            if len(rows) == limit:
+                break
+        return rows
+
+    async def product_changes_version(self):
+        return self.last_ids["product_changes"]
+
+    # Customers
+    async def create_customer(self, name, email):
+        if email in self.customers_by_email:
+            raise ConflictError(f"Customer with email {email} already exists")
+        customer = (self._next_id("customers"), name, email)
+        self._put_customer(customer)
+        return customer
+
+    async def get_customer(self, customer_id):
+        return self.customers.get(customer_id)
+
+    async def get_customers(self, customer_ids):
+        return {customer_id: self.customers[customer_id] for customer_id in customer_ids
+                if customer_id in self.customers}
+
+    async def get_customers_by_email(self, emails):
+        return {email: self.customers[self.customers_by_email[email]] for email in emails
+                if email in self.customers_by_email}
+
+    # Orders: everything is checked before anything changes, so a rejected order leaves no trace
+    async def place_order(self, customer_id, status, quantities):
+        if customer_id not in self.customers:
+            raise NotFoundError(f"Customer {customer_id} not found")
+        for product_id, quantity in quantities.items():
+            product = self.products.get(product_id)
+            if product is None:
+                raise NotFoundError(f"Product {product_id} not found")
+            if product[3] < quantity:
+                raise ConflictError(f"Insufficient stock for product {product_id}")
+
+        order_date = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        order = (self._next_id("orders"), customer_id, order_date, status)
+        self._put_order(order)
+        items = []
+        for product_id, quantity in quantities.items():
+            product_id, name, price, stock = self.products[product_id]
+            self.products[product_id] = (product_id, name, price, stock - quantity)
+            self._record_change(product_id)
+            item = (self._next_id("order_items"), order[0], product_id, quantity, price)
+            self._put_order_item(item)
+            self._add_sales(item)
+            items.append(item)
+        return order, items
+
+    async def get_order(self, order_id):
+        return self.orders.get(order_id)
+
+    async def list_order_items(self, order_id):
+        return [self.order_items[item_id] for item_id in self.items_by_order.get(order_id, [])]
+
+    def _order_detail(self, order_id):
+        lines = []
+        for item_id in self.items_by_order.get(order_id, []):
+            item = self.order_items[item_id]
+            product = self.products.get(item[2])
+            lines.append((item[0], item[2], product[1] if product else None, item[3], item[4]))
+        return self.orders[order_id], lines
+
+    async def get_order_details(self, order_ids):
+        return {order_id: self._order_detail(order_id) for order_id in sorted(set(order_ids))
+                if order_id in self.orders}
+
+    async def list_customer_orders(self, customer_id, before_id=None, limit=50):
+        order_ids = self.orders_by_customer.get(customer_id, [])
+        end = len(order_ids) if before_id is None else bisect.bisect_left(order_ids, before_id)
+        return [self._order_detail(order_id) for order_id in reversed(order_ids[max(end - limit, 0):end])]
+
+    # Sales
+    async def sales_total(self):
+        return tuple(self.sales_totals)
+
+    async def product_sales(self, product_id):
+        return tuple(self.sales_by_product.get(product_id, (0, 0)))
+
+    async def customer_sales(self, customer_id):
+        return tuple(self.sales_by_customer.get(customer_id, (0, 0)))
+
+    async def daily_sales(self, start, end):
+        return [(day, total, quantity) for day, (total, quantity) in sorted(self.sales_by_day.items())
+                if start <= day <= end]
@@ -0,0 +1,277 @@
+import re
+import sqlite3
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+import profiling
+
+# Minimal Prometheus-style instrumentation: counters, histograms and callback gauges, rendered
+# in the text exposition format by GET /metrics. Each observation is a lock and a few
+# arithmetic operations, cheap enough to leave on in production.
+
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+# Value read when /metrics is scraped
+class Gauge:
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        REGISTRY.append(self)
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP metrics
+REQUESTS = Counter("http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+REQUEST_ERRORS = Counter("http_request_errors_total", "HTTP requests that failed with a 5xx or an exception",
+                         ("method", "route"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+
+# Database metrics
+STATEMENT_LATENCY = Histogram("db_statement_duration_seconds", "Time spent executing each SQL statement and fetching its rows",
+                              ("statement",), buckets=DB_BUCKETS)
+STATEMENT_ROWS = Counter("db_rows_returned_total", "Rows fetched per SQL statement", ("statement",))
+WRITE_BATCH_SIZE = Histogram("db_write_batch_size", "Writes committed per group-commit transaction",
+                             buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+WRITE_BATCH_DURATION = Histogram("db_write_batch_duration_seconds", "Time to run and commit one write batch",
+                                 buckets=DB_BUCKETS)
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection", buckets=DB_BUCKETS)
+
+
+# ASGI middleware recording count, errors and latency per route template (/products/{product_id})
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "<unmatched>"
+            method = scope["method"]
+            REQUEST_LATENCY.observe(perf_counter() - start, method, path)
+            REQUESTS.inc(method, path, str(status))
+            if status >= 500:
+                REQUEST_ERRORS.inc(method, path)
+
+
+_WHITESPACE = re.compile(r"\s+")
+_labels = {}
+
+
+# Statements are literals in the code, so the label set stays small; long ones are shortened
+def statement_label(sql):
+    label = _labels.get(sql)
+    if label is None:
+        label = _WHITESPACE.sub(" ", sql).strip()
+        if len(label) > 100:
+            label = label[:97] + "..."
+        _labels[sql] = label
+    return label
+
+
+# Cursor that times each statement from execute() until its rows are consumed (the cursor runs
+# out, is closed, runs its next statement or goes away) and counts the rows returned, whether
+# fetched or iterated. Statements slower than SHOP_SLOW_QUERY_MS are also written to the
+# slow-query log.
+class TimedCursor(sqlite3.Cursor):
+    _statement = ""  # label of the last statement, for the row counts
+    _timing = False  # a statement is running or has rows left; _elapsed is its time so far
+    _elapsed = 0.0
+    _query = None  # (sql, parameters, many) of the running statement, for the slow-query log
+
+    def _start(self, sql, parameters, many=False):
+        self._finish()
+        self._statement = statement_label(sql)
+        self._timing, self._elapsed = True, 0.0
+        if profiling.SLOW_QUERY_SECONDS:
+            self._query = (sql, parameters, many)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed += perf_counter() - start
+            if self.description is None:
+                self._finish()  # no rows to fetch, the statement is done
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None, many=True)
+        start = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed += perf_counter() - start
+            self._finish()
+
+    def _finish(self):
+        if not self._timing:
+            return
+        self._timing = False
+        STATEMENT_LATENCY.observe(self._elapsed, self._statement)
+        if self._query is not None:
+            sql, parameters, many = self._query
+            self._query = None
+            profiling.log_slow_query(self.connection, sql, parameters, self._elapsed, many)
+
+    def __next__(self):
+        start = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += perf_counter() - start
+            self._finish()
+            raise
+        self._elapsed += perf_counter() - start
+        STATEMENT_ROWS.inc(self._statement)
+        return row
+
+    def fetchone(self):
+        start = perf_counter()
+        row = super().fetchone()
+        self._elapsed += perf_counter() - start
+        if row is None:
+            self._finish()
+        else:
+            STATEMENT_ROWS.inc(self._statement)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = perf_counter()
+        rows = super().fetchmany(size)
+        self._elapsed += perf_counter() - start
+        STATEMENT_ROWS.inc(self._statement, amount=len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = super().fetchall()
+        self._elapsed += perf_counter() - start
+        STATEMENT_ROWS.inc(self._statement, amount=len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    # connection.execute(...).fetchone() drops the cursor with rows possibly left
+    def __del__(self):
+        self._finish()
+
+
+# Connection factory whose cursors (including the connection.execute shortcuts) are TimedCursors
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,120 @@
+import argparse
+import sqlite3
+
+import archive
+import changes
+import config
+import sales
+import search
+
+# Versioned schema migrations. The schema version is stored in PRAGMA user_version; at startup
+# every migration newer than that runs, in order, each in its own transaction.
+# Never edit a migration that has shipped: append a new one instead.
+
+MIGRATIONS = [
+    (1, "base tables", """
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        quantity INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER NOT NULL,
+        order_date TEXT NOT NULL,
+        status TEXT NOT NULL,
+        FOREIGN KEY (customer_id) REFERENCES customers(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders(id),
+        FOREIGN KEY (product_id) REFERENCES products(id)
+    );
+    """),
+
+    (2, "sales rollups", sales.ROLLUP_SCHEMA + """
+    INSERT OR IGNORE INTO sales_totals (id, total, quantity) VALUES (1, 0, 0);
+    """ + sales.REBUILD_SQL),
+
+    # Foreign-key and lookup indexes. order_items(product_id) also keeps product deletes from
+    # scanning order_items for the foreign key check.
+    (3, "secondary indexes", """
+    CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id);
+    CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id);
+    CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON orders (customer_id);
+    CREATE INDEX IF NOT EXISTS idx_products_name ON products (name);
+    """),
+
+    (4, "product change log", changes.CHANGELOG_SCHEMA + changes.BACKFILL_SQL),
+
+    (5, "product search index", search.SEARCH_SCHEMA + search.BACKFILL_SQL),
+
+    (6, "order archiving", archive.INDEX_SCHEMA + sales.ARCHIVE_AWARE_DELETE_TRIGGER),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version;").fetchone()[0]
+
+
+# Split a migration script into single statements (trigger bodies and quoted semicolons stay whole),
+# so they can run inside a transaction that executescript would commit first
+def split_statements(script):
+    *pieces, rest = script.split(";")
+    statement = ""
+    for piece in pieces:
+        statement += piece + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \t\r\n;"):
+                yield statement.strip()
+            statement = ""
+    if (statement + rest).strip():
+        raise ValueError(f"Incomplete statement at the end of a migration: {(statement + rest).strip()[:80]}")
+
+
+# Bring the database up to LATEST_VERSION. Returns the list of versions that were applied.
+# The version is read again under the write lock: when several workers start on an old database,
+# the ones that waited for the lock skip what the first one already applied.
+def migrate(connection):
+    applied = []
+    for version, description, script in MIGRATIONS:
+        if version <= schema_version(connection):
+            continue
+        connection.execute("BEGIN IMMEDIATE;")
+        try:
+            if version > schema_version(connection):
+                for statement in split_statements(script):
+                    connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {version};")
+                applied.append(version)
+            connection.execute("COMMIT;")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK;")
+            raise
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    args = parser.parse_args()
+    connection = sqlite3.connect(args.database, isolation_level=None)
+    applied = migrate(connection)
+    print(f"Schema at version {schema_version(connection)} (applied: {applied or 'none'})")
+    connection.close()
@@ -0,0 +1,115 @@
+import cProfile
+import io
+import logging
+import pstats
+import sqlite3
+import threading
+
+import config
+
+# Diagnostics for latency spikes: a slow-query log fed by the statement timings in metrics.py,
+# and an on-demand cProfile of the next N requests.
+
+slow_query_logger = logging.getLogger("shop.slow_query")
+
+SLOW_QUERY_SECONDS = config.SLOW_QUERY_MS / 1000
+
+
+# Bound values are never logged, only their types
+def redact(parameters):
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+def explain(connection, sql, parameters):
+    try:
+        # plain Connection.execute, so the EXPLAIN itself is not timed or logged
+        rows = sqlite3.Connection.execute(connection, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        return " | ".join(row[3] for row in rows) or "n/a"
+    except sqlite3.Error:
+        return "n/a"
+
+
+# Called by metrics.TimedCursor when the slow-query log is on, once a statement has finished: duration
+# covers execute() and fetching every row
+def log_slow_query(connection, sql, parameters, duration, many=False):
+    if duration < SLOW_QUERY_SECONDS:
+        return
+    plan = "n/a" if many else explain(connection, sql, parameters)
+    slow_query_logger.warning("slow query %.1f ms: %s params=%s plan=%s", duration * 1000,
+                              " ".join(sql.split()), "executemany" if many else redact(parameters), plan)
+
+
+# Profiles the next N requests with one shared cProfile.Profile. The profiler is on while at least
+# one armed request is in flight; it only sees the event loop thread (the SQL itself runs on the
+# database executor and shows up in the slow-query log and /metrics instead).
+class RequestProfiler:
+    def __init__(self):
+        self.profile = None
+        self.remaining = 0
+        self.profiled = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    # Returns False while profiled requests are still in flight: swapping the profile then would
+    # leave the old one enabled and lose its samples
+    def arm(self, requests):
+        with self._lock:
+            if self._active:
+                return False
+            self.profile = cProfile.Profile()
+            self.remaining = requests
+            self.profiled = 0
+            return True
+
+    def reset(self):
+        with self._lock:
+            self.remaining = 0
+            self.profile = None if self._active == 0 else self.profile
+
+    def _start(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self._active += 1
+            if self._active == 1:
+                self.profile.enable()
+            return True
+
+    def _stop(self):
+        with self._lock:
+            self._active -= 1
+            self.profiled += 1
+            if self._active == 0:
+                self.profile.disable()
+
+    def report(self, limit=40, sort="cumulative"):
+        with self._lock:
+            if self.profile is None or self.profiled == 0:
+                return "No profiled requests yet.\n"
+            if self._active:
+                return "Profiled requests still in flight, try again.\n"
+            out = io.StringIO()
+            out.write(f"{self.profiled} profiled requests, {self.remaining} still to go\n\n")
+            pstats.Stats(self.profile, stream=out).sort_stats(sort).print_stats(limit)
+            return out.getvalue()
+
+
+# ASGI middleware that hands armed requests to the profiler
+class ProfilingMiddleware:
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.profiler.remaining <= 0 or scope["path"].startswith("/admin/"):
+            await self.app(scope, receive, send)
+            return
+        profiled = self.profiler._start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if profiled:
+                self.profiler._stop()
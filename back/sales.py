@@ -0,0 +1,150 @@
+import argparse
+import os
+import sqlite3
+
+import config
+
+# Pre-aggregated sales rollups. Triggers on order_items (and on orders, when an order moves to
+# another customer or date) keep them current, so /sales/* reads a single row instead of
+# summing the whole order history. The tables are created by migration 2 (migrations.py).
+
+
+def _apply(row, sign):
+    amount = f"{sign}{row}.quantity * {row}.price"
+    quantity = f"{sign}{row}.quantity"
+    return f"""
+        UPDATE sales_totals SET total = total + ({amount}), quantity = quantity + ({quantity}) WHERE id = 1;
+        INSERT INTO sales_by_product (product_id, total, quantity) VALUES ({row}.product_id, {amount}, {quantity})
+            ON CONFLICT(product_id) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+        INSERT INTO sales_by_day (day, total, quantity)
+            SELECT substr(order_date, 1, 10), {amount}, {quantity} FROM orders WHERE id = {row}.order_id
+            ON CONFLICT(day) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;
+        INSERT INTO sales_by_customer (customer_id, total, quantity)
+            SELECT customer_id, {amount}, {quantity} FROM orders WHERE id = {row}.order_id
+            ON CONFLICT(customer_id) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;"""
+
+
+def _move_order(key_column, table, key_expr, row, sign):
+    return f"""
+        INSERT INTO {table} ({key_column}, total, quantity)
+            SELECT {key_expr.format(row=row)}, {sign}COALESCE(SUM(quantity * price), 0), {sign}COALESCE(SUM(quantity), 0)
+            FROM order_items WHERE order_id = {row}.id
+            ON CONFLICT({key_column}) DO UPDATE SET total = total + excluded.total, quantity = quantity + excluded.quantity;"""
+
+
+ROLLUP_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sales_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total REAL NOT NULL,
+    quantity INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sales_by_product (
+    product_id INTEGER PRIMARY KEY,
+    total REAL NOT NULL,
+    quantity INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sales_by_day (
+    day TEXT PRIMARY KEY,
+    total REAL NOT NULL,
+    quantity INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sales_by_customer (
+    customer_id INTEGER PRIMARY KEY,
+    total REAL NOT NULL,
+    quantity INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS sales_order_item_insert AFTER INSERT ON order_items BEGIN
+    {_apply("NEW", "+")}
+END;
+CREATE TRIGGER IF NOT EXISTS sales_order_item_delete AFTER DELETE ON order_items BEGIN
+    {_apply("OLD", "-")}
+END;
+CREATE TRIGGER IF NOT EXISTS sales_order_item_update
+AFTER UPDATE OF order_id, product_id, quantity, price ON order_items BEGIN
+    {_apply("OLD", "-")}
+    {_apply("NEW", "+")}
+END;
+CREATE TRIGGER IF NOT EXISTS sales_order_move
+AFTER UPDATE OF customer_id, order_date ON orders BEGIN
+    {_move_order("customer_id", "sales_by_customer", "{row}.customer_id", "OLD", "-")}
+    {_move_order("customer_id", "sales_by_customer", "{row}.customer_id", "NEW", "")}
+    {_move_order("day", "sales_by_day", "substr({row}.order_date, 1, 10)", "OLD", "-")}
+    {_move_order("day", "sales_by_day", "substr({row}.order_date, 1, 10)", "NEW", "")}
+END;
+"""
+
+
+# Migration 6: order items moved to an archive (see archive.py) are deleted from order_items but
+# stay counted in the rollups; archive.py records them in archived_orders before deleting them
+ARCHIVE_AWARE_DELETE_TRIGGER = f"""
+DROP TRIGGER IF EXISTS sales_order_item_delete;
+CREATE TRIGGER sales_order_item_delete AFTER DELETE ON order_items
+WHEN NOT EXISTS (SELECT 1 FROM archived_orders WHERE order_id = OLD.order_id) BEGIN
+    {_apply("OLD", "-")}
+END;
+"""
+
+
+# Recompute every rollup from order_items (backfill, or to repair drift)
+REBUILD_SQL = """
+DELETE FROM sales_by_product;
+DELETE FROM sales_by_day;
+DELETE FROM sales_by_customer;
+INSERT OR REPLACE INTO sales_totals (id, total, quantity)
+    SELECT 1, COALESCE(SUM(quantity * price), 0), COALESCE(SUM(quantity), 0) FROM order_items;
+INSERT INTO sales_by_product (product_id, total, quantity)
+    SELECT product_id, SUM(quantity * price), SUM(quantity) FROM order_items GROUP BY product_id;
+INSERT INTO sales_by_day (day, total, quantity)
+    SELECT substr(o.order_date, 1, 10), SUM(i.quantity * i.price), SUM(i.quantity)
+    FROM order_items i JOIN orders o ON o.id = i.order_id
+    GROUP BY substr(o.order_date, 1, 10);
+INSERT INTO sales_by_customer (customer_id, total, quantity)
+    SELECT o.customer_id, SUM(i.quantity * i.price), SUM(i.quantity)
+    FROM order_items i JOIN orders o ON o.id = i.order_id
+    GROUP BY o.customer_id;
+"""
+
+
+# extra_sql runs in the same transaction, after the rebuild (archive.py adds archived sales with it)
+def rebuild_sales_rollups(connection, extra_sql=""):
+    try:
+        connection.executescript(f"BEGIN IMMEDIATE;\n{REBUILD_SQL}\n{extra_sql}\nCOMMIT;")
+    except BaseException:
+        if connection.in_transaction:
+            connection.rollback()
+        raise
+
+
+# Read helpers used by the /sales endpoints
+def select_total(connection):
+    return connection.execute("SELECT total, quantity FROM sales_totals WHERE id = 1;").fetchone() or (0, 0)
+
+def select_product_sales(connection, product_id):
+    return connection.execute("SELECT total, quantity FROM sales_by_product WHERE product_id = ?;",
+                              (product_id,)).fetchone() or (0, 0)
+
+def select_customer_sales(connection, customer_id):
+    return connection.execute("SELECT total, quantity FROM sales_by_customer WHERE customer_id = ?;",
+                              (customer_id,)).fetchone() or (0, 0)
+
+def select_daily_sales(connection, start, end):
+    return connection.execute("SELECT day, total, quantity FROM sales_by_day WHERE day BETWEEN ? AND ? ORDER BY day;",
+                              (start, end)).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the sales rollup tables")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    parser.add_argument("--archive-dir", help="archive directory (default: SHOP_ARCHIVE_DIR, or archive/ "
+                                              "next to the database)")
+    args = parser.parse_args()
+    import archive  # archived orders still count (see archive.py)
+    archive_dir = args.archive_dir or os.getenv("SHOP_ARCHIVE_DIR") or os.path.join(
+        os.path.dirname(args.database), "archive")
+    connection = sqlite3.connect(args.database, isolation_level=None)
+    archive.rebuild_sales_rollups(connection, archive_dir)
+    total, quantity = select_total(connection)
+    connection.close()
+    print(f"Sales rollups rebuilt: total={total} quantity={quantity}")
@@ -0,0 +1,60 @@
+import re
+import unicodedata
+
+# Full-text product search. products_fts is an FTS5 index over products.name (external content:
+# the names are not stored twice), kept in step by triggers and filled for existing products by
+# migration 5 (migrations.py). Prefix indexes on 2 and 3 characters keep autocomplete fast.
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name,
+    content='products',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+END;
+"""
+
+BACKFILL_SQL = """
+INSERT INTO products_fts (products_fts) VALUES ('rebuild');
+"""
+
+MAX_TERMS = 16
+
+_TERM = re.compile(r"\w+")
+
+
+# Split a query the way unicode61 does: lower case, accents removed, runs of letters and digits
+def terms(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _TERM.findall(text)[:MAX_TERMS]
+
+
+# Build an FTS5 MATCH expression from user input: every term must match and each is quoted, so FTS5
+# syntax in the input is taken literally. With prefix, terms also match as word prefixes
+# (autocomplete: "gre app" finds "Green apple"). None when the input has no searchable terms.
+def match_expression(query, prefix=True):
+    words = terms(query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' if prefix else f'"{word}"' for word in words)
+
+
+# Best matches first (FTS5 rank is bm25), ties by id
+def select_search(connection, expression, limit):
+    return connection.execute("SELECT p.id, p.name, p.price, p.quantity FROM products_fts "
+                              "JOIN products p ON p.id = products_fts.rowid "
+                              "WHERE products_fts MATCH ? ORDER BY products_fts.rank, p.id LIMIT ?;",
+                              (expression, limit)).fetchall()
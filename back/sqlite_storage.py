@@ -0,0 +1,268 @@
+import json
+import sqlite3
+
+import archive
+import changes
+import config
+import migrations
+import sales
+import search
+from bulk import write_products_chunk
+from db import ConnectionPool, Database
+from encoders import PRODUCT_COLUMNS
+from storage import ConflictError, NotFoundError, Storage
+
+# SQLite storage engine: every query below runs on the database executor with a pooled connection,
+# writes through the group-commit writer (see db.py)
+
+
+# Product queries
+def insert_product(connection, name, price, quantity):
+    # RETURNING hands back the new row from the INSERT itself, no second lookup needed
+    cursor = connection.execute("INSERT INTO products (name, price, quantity) VALUES (?, ?, ?) "
+                                "RETURNING id, name, price, quantity;",
+                                (name, price, quantity))
+    new_product = cursor.fetchone()
+    cursor.close()
+    return new_product
+
+# columns are interpolated into the SELECT list: they must come from PRODUCT_COLUMNS. ORDER BY id is
+# needed: for id and name alone SQLite reads the covering idx_products_name, which is in name order.
+def select_all_products(connection, columns=PRODUCT_COLUMNS):
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {', '.join(columns)} FROM products ORDER BY id;")
+    products = cursor.fetchall()  # Returns a list of tuples
+    cursor.close()
+    return products
+
+# Keyset page: rows with id greater than after_id, in id order (walks the primary key, no OFFSET scan)
+def select_products_page(connection, after_id, limit, columns=PRODUCT_COLUMNS):
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {', '.join(columns)} FROM products WHERE id > ? ORDER BY id LIMIT ?;",
+                   (after_id, limit))
+    products = cursor.fetchall()
+    cursor.close()
+    return products
+
+def select_product(connection, product_id):
+    cursor = connection.cursor()
+    cursor.execute("SELECT id, name, price, quantity FROM products WHERE id = ?;", (product_id,))
+    product = cursor.fetchone()  # Returns a tuple
+    cursor.close()
+    return product
+
+# Batch lookups bind the whole id (or email) list as one JSON array parameter, read with json_each
+def select_products(connection, product_ids):
+    rows = connection.execute("SELECT id, name, price, quantity FROM products "
+                              "WHERE id IN (SELECT value FROM json_each(?));", (json.dumps(list(product_ids)),))
+    return {row[0]: row for row in rows}
+
+def update_product_row(connection, product_id, name, price, quantity):
+    cursor = connection.execute("UPDATE products SET name = ?, price = ?, quantity = ? WHERE id = ? "
+                                "RETURNING id, name, price, quantity;",
+                                (name, price, quantity, product_id))
+    updated_product = cursor.fetchone()  # None when no product has this id
+    cursor.close()
+    return updated_product
+
+def delete_product_row(connection, product_id):
+    try:
+        connection.execute("DELETE FROM products WHERE id = ?;", (product_id,))
+    except sqlite3.IntegrityError:
+        raise ConflictError(f"Product {product_id} has order items")
+
+
+# Customer queries
+def insert_customer(connection, name, email):
+    try:
+        return connection.execute("INSERT INTO customers (name, email) VALUES (?, ?) RETURNING id, name, email;",
+                                  (name, email)).fetchone()
+    except sqlite3.IntegrityError:
+        raise ConflictError(f"Customer with email {email} already exists")
+
+def select_customer(connection, customer_id):
+    return connection.execute("SELECT id, name, email FROM customers WHERE id = ?;", (customer_id,)).fetchone()
+
+
+def select_customers(connection, customer_ids):
+    rows = connection.execute("SELECT id, name, email FROM customers WHERE id IN (SELECT value FROM json_each(?));",
+                              (json.dumps(list(customer_ids)),))
+    return {row[0]: row for row in rows}
+
+def select_customers_by_email(connection, emails):
+    rows = connection.execute("SELECT id, name, email FROM customers "
+                              "WHERE email IN (SELECT value FROM json_each(?));", (json.dumps(list(emails)),))
+    return {row[2]: row for row in rows}
+
+
+# Order queries
+def select_order(connection, order_id):
+    return connection.execute("SELECT id, customer_id, order_date, status FROM orders WHERE id = ?;",
+                              (order_id,)).fetchone()
+
+def select_order_items(connection, order_id):
+    return connection.execute("SELECT id, order_id, product_id, quantity, price FROM order_items "
+                              "WHERE order_id = ? ORDER BY id;", (order_id,)).fetchall()
+
+# Orders with their lines and product names in one statement: items are found through
+# idx_order_items_order_id and products by primary key, so showing an order costs no extra queries.
+# Archived orders are read from the history views instead (see archive.py).
+ORDER_DETAIL_SQL = """SELECT o.id, o.customer_id, o.order_date, o.status, i.id, i.product_id, p.name, i.quantity, i.price
+    FROM orders o LEFT JOIN order_items i ON i.order_id = o.id LEFT JOIN products p ON p.id = i.product_id
+    WHERE o.id IN ({orders}) ORDER BY o.id {direction}, i.id;"""
+
+def group_order_details(rows):
+    details = {}
+    for row in rows:
+        order, lines = details.setdefault(row[0], (row[:4], []))
+        if row[4] is not None:  # an order without items still gets one row from the LEFT JOIN
+            lines.append(row[4:])
+    return details
+
+# The ids travel as one JSON array parameter, so the statement (and its cached plan) is the same for
+# any count. Ids the hot tables do not have are looked up in the archives.
+def select_order_details(connection, order_ids, archive_dir=config.ARCHIVE_DIR):
+    rows = connection.execute(ORDER_DETAIL_SQL.format(orders="SELECT value FROM json_each(?)", direction="ASC"),
+                              (json.dumps(list(order_ids)),)).fetchall()
+    details = group_order_details(rows)
+    missing = [order_id for order_id in set(order_ids) if order_id not in details]
+    if missing:
+        details.update(select_archived_order_details(connection, missing, archive_dir))
+    return details
+
+def select_archived_order_details(connection, order_ids, archive_dir):
+    details = {}
+    for paths in archive.archive_groups(connection, order_ids, archive_dir):
+        with archive.history_views(connection, paths):
+            rows = connection.execute(archive.HISTORY_DETAIL_SQL, (json.dumps(order_ids),)).fetchall()
+        details.update(group_order_details(rows))
+    return details
+
+def select_customer_orders(connection, customer_id, before_id, limit, archive_dir=config.ARCHIVE_DIR):
+    if archive.has_archived_orders(connection, customer_id, before_id):
+        order_ids = archive.select_customer_order_ids(connection, customer_id, before_id, limit)
+        details = select_order_details(connection, order_ids, archive_dir)
+        return [details[order_id] for order_id in order_ids if order_id in details]
+    orders = "SELECT id FROM orders WHERE customer_id = ? AND id < ? ORDER BY id DESC LIMIT ?"
+    rows = connection.execute(ORDER_DETAIL_SQL.format(orders=orders, direction="DESC"),
+                              (customer_id, before_id, limit)).fetchall()
+    return list(group_order_details(rows).values())
+
+# Place a whole order in one write transaction: the order row, its items at the current product
+# price, and the stock decrements. Any failure raises and the transaction is rolled back.
+def place_order(connection, customer_id, status, quantities):
+    if connection.execute("SELECT 1 FROM customers WHERE id = ?;", (customer_id,)).fetchone() is None:
+        raise NotFoundError(f"Customer {customer_id} not found")
+
+    order = connection.execute("INSERT INTO orders (customer_id, order_date, status) "
+                               "VALUES (?, datetime('now'), ?) RETURNING id, customer_id, order_date, status;",
+                               (customer_id, status)).fetchone()
+    items = []
+    for product_id, quantity in quantities.items():
+        # Guarded decrement: only succeeds while enough stock is left, so concurrent orders cannot oversell
+        product = connection.execute("UPDATE products SET quantity = quantity - ? "
+                                     "WHERE id = ? AND quantity >= ? RETURNING price;",
+                                     (quantity, product_id, quantity)).fetchone()
+        if product is None:
+            if connection.execute("SELECT 1 FROM products WHERE id = ?;", (product_id,)).fetchone() is None:
+                raise NotFoundError(f"Product {product_id} not found")
+            raise ConflictError(f"Insufficient stock for product {product_id}")
+        item = connection.execute("INSERT INTO order_items (order_id, product_id, quantity, price) "
+                                  "VALUES (?, ?, ?, ?) RETURNING id, order_id, product_id, quantity, price;",
+                                  (order[0], product_id, quantity, product[0])).fetchone()
+        items.append(item)
+    return order, items
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path=config.DATABASE_PATH, archive_dir=config.ARCHIVE_DIR):
+        self.path = path
+        self.archive_dir = archive_dir
+        self.db = None
+
+    # Create or upgrade the schema (see migrations.py), then open the connection pool
+    async def open(self):
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        migrations.migrate(connection)
+        connection.close()
+        self.db = Database(ConnectionPool(self.path))
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+
+    async def create_product(self, name, price, quantity):
+        return await self.db.write(insert_product, name, price, quantity)
+
+    async def get_product(self, product_id):
+        return await self.db.read(select_product, product_id)
+
+    async def list_products(self, after_id=0, limit=None, columns=PRODUCT_COLUMNS):
+        if limit is None and after_id == 0:
+            return await self.db.read(select_all_products, columns)
+        return await self.db.read(select_products_page, after_id, -1 if limit is None else limit, columns)
+
+    async def get_products(self, product_ids):
+        return await self.db.read(select_products, product_ids)
+
+    async def search_products(self, query, limit, prefix=True):
+        expression = search.match_expression(query, prefix)
+        if expression is None:
+            return []
+        return await self.db.read(search.select_search, expression, limit)
+
+    async def update_product(self, product_id, name, price, quantity):
+        return await self.db.write(update_product_row, product_id, name, price, quantity)
+
+    async def delete_product(self, product_id):
+        await self.db.write(delete_product_row, product_id)
+
+    async def write_products(self, rows):
+        return await self.db.write(write_products_chunk, rows)
+
+    async def list_product_changes(self, since, limit):
+        return await self.db.read(changes.select_product_changes, since, limit)
+
+    async def product_changes_version(self):
+        return await self.db.read(changes.select_changes_version)
+
+    async def create_customer(self, name, email):
+        return await self.db.write(insert_customer, name, email)
+
+    async def get_customer(self, customer_id):
+        return await self.db.read(select_customer, customer_id)
+
+    async def get_customers(self, customer_ids):
+        return await self.db.read(select_customers, customer_ids)
+
+    async def get_customers_by_email(self, emails):
+        return await self.db.read(select_customers_by_email, emails)
+
+    async def place_order(self, customer_id, status, quantities):
+        return await self.db.write(place_order, customer_id, status, quantities)
+
+    async def get_order(self, order_id):
+        return await self.db.read(select_order, order_id)
+
+    async def list_order_items(self, order_id):
+        return await self.db.read(select_order_items, order_id)
+
+    async def get_order_details(self, order_ids):
+        return await self.db.read(select_order_details, order_ids, self.archive_dir)
+
+    async def list_customer_orders(self, customer_id, before_id=None, limit=50):
+        before_id = 2 ** 63 - 1 if before_id is None else before_id
+        return await self.db.read(select_customer_orders, customer_id, before_id, limit, self.archive_dir)
+
+    # Sales figures come from the rollup tables (see sales.py), so each answer is a single-row lookup
+    async def sales_total(self):
+        return await self.db.read(sales.select_total)
+
+    async def product_sales(self, product_id):
+        return await self.db.read(sales.select_product_sales, product_id)
+
+    async def customer_sales(self, customer_id):
+        return await self.db.read(sales.select_customer_sales, customer_id)
+
+    async def daily_sales(self, start, end):
+        return await self.db.read(sales.select_daily_sales, start, end)
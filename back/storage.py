@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+
+from starlette.requests import HTTPConnection
+
+import config
+from encoders import PRODUCT_COLUMNS
+
+# Storage interface used by the routes. Two engines implement it: SqliteStorage (sqlite_storage.py,
+# the default) and MemoryStorage (memory_storage.py, indexed dicts for tests, benchmarks and
+# read-mostly replicas). SHOP_STORAGE picks one.
+#
+# Rows are plain tuples in table column order:
+#   product    (id, name, price, quantity)
+#   customer   (id, name, email)
+#   order      (id, customer_id, order_date, status)
+#   order item (id, order_id, product_id, quantity, price)
+
+
+class NotFoundError(Exception):
+    pass
+
+
+class ConflictError(Exception):
+    pass
+
+
+class Storage(ABC):
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # Products
+    @abstractmethod
+    async def create_product(self, name, price, quantity):
+        ...
+
+    @abstractmethod
+    async def get_product(self, product_id):
+        ...
+
+    # Products with id > after_id in id order; every product when limit is None. columns is a
+    # subset of PRODUCT_COLUMNS, in that order, and the rows hold just those columns.
+    @abstractmethod
+    async def list_products(self, after_id=0, limit=None, columns=PRODUCT_COLUMNS):
+        ...
+
+    # Batch lookup: {id: product} for those of product_ids that exist
+    @abstractmethod
+    async def get_products(self, product_ids):
+        ...
+
+    # Full-text search on product names, best matches first (see search.py)
+    @abstractmethod
+    async def search_products(self, query, limit, prefix=True):
+        ...
+
+    # Returns the updated row, or None when there is no such product
+    @abstractmethod
+    async def update_product(self, product_id, name, price, quantity):
+        ...
+
+    # Raises ConflictError while order items still reference the product
+    @abstractmethod
+    async def delete_product(self, product_id):
+        ...
+
+    # Bulk write: rows are (index, id or None, name, price, quantity); rows with an id are upserted.
+    # Returns ({index: id}, {index: error message}).
+    @abstractmethod
+    async def write_products(self, rows):
+        ...
+
+    # Product change log: (version, id, deleted, name, price, quantity) rows with version > since, in
+    # version order, one per product (its latest change); name, price and quantity are None for deletes
+    @abstractmethod
+    async def list_product_changes(self, since, limit):
+        ...
+
+    # Latest product change version (0 before the first change)
+    @abstractmethod
+    async def product_changes_version(self):
+        ...
+
+    # Customers
+    @abstractmethod
+    async def create_customer(self, name, email):
+        ...
+
+    @abstractmethod
+    async def get_customer(self, customer_id):
+        ...
+
+    # Batch lookups: {id: customer} and {email: customer} for the ids / emails that exist
+    @abstractmethod
+    async def get_customers(self, customer_ids):
+        ...
+
+    @abstractmethod
+    async def get_customers_by_email(self, emails):
+        ...
+
+    # Orders: place_order takes {product_id: quantity}, decrements stock and returns (order, items).
+    # Raises NotFoundError for an unknown customer or product and ConflictError when stock is short.
+    @abstractmethod
+    async def place_order(self, customer_id, status, quantities):
+        ...
+
+    @abstractmethod
+    async def get_order(self, order_id):
+        ...
+
+    @abstractmethod
+    async def list_order_items(self, order_id):
+        ...
+
+    # Order details: {order id: (order, lines)} for those of order_ids that exist, where lines are
+    # (item id, product_id, product name, quantity, price) in item order
+    @abstractmethod
+    async def get_order_details(self, order_ids):
+        ...
+
+    # A customer's orders with id < before_id (every order when None), newest first, as (order, lines)
+    @abstractmethod
+    async def list_customer_orders(self, customer_id, before_id=None, limit=50):
+        ...
+
+    # Sales: (total, quantity) pairs, and (day, total, quantity) rows for daily_sales
+    @abstractmethod
+    async def sales_total(self):
+        ...
+
+    @abstractmethod
+    async def product_sales(self, product_id):
+        ...
+
+    @abstractmethod
+    async def customer_sales(self, customer_id):
+        ...
+
+    @abstractmethod
+    async def daily_sales(self, start, end):
+        ...
+
+
+def create_storage(backend=config.STORAGE_BACKEND):
+    if backend == "sqlite":
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage()
+    if backend == "memory":
+        from memory_storage import MemoryStorage
+        return MemoryStorage(snapshot_path=config.MEMORY_SNAPSHOT_PATH)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+# FastAPI dependency handing the storage engine to a route (HTTP or WebSocket)
+def get_storage(connection: HTTPConnection):
+    return connection.app.state.storage
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared HTTP client for the front end: one keep-alive requests.Session for every screen, plus an
+# on-disk cache of GET responses. Cached responses are revalidated with If-None-Match, so unchanged
+# data costs a 304, and the last known data can be shown at start-up before the server has answered.
+
+API_SERVER_URL = "http://localhost:8000"
+REQUEST_TIMEOUT = 10  # seconds
+
+# Response headers worth keeping with a cached body
+CACHED_HEADERS = ("ETag", "X-Next-After-Id")
+
+
+class ApiClient:
+    def __init__(self, base_url=API_SERVER_URL, cache_dir=None, timeout=REQUEST_TIMEOUT, pool_size=4):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _url(self, path):
+        return self.base_url + path
+
+    def _cache_path(self, path, params):
+        key = path + "?" + "&".join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _read_cache(self, path, params):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(path, params), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Write to a temporary file first so a crash never leaves a half-written entry behind
+    def _write_cache(self, path, params, entry):
+        if not self.cache_dir:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(temp_path, self._cache_path(path, params))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # Last known (data, headers) for a GET, without touching the network; None if never fetched
+    def cached_json(self, path, params=None):
+        entry = self._read_cache(path, params)
+        if entry is None:
+            return None
+        return entry["data"], entry["headers"]
+
+    # GET returning (data, headers); revalidates the cached copy when there is one
+    def get_json(self, path, params=None):
+        entry = self._read_cache(path, params)
+        headers = {}
+        if entry is not None:
+            if entry["headers"].get("ETag"):
+                headers["If-None-Match"] = entry["headers"]["ETag"]
+        response = self.session.get(self._url(path), params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and entry is not None:
+            return entry["data"], entry["headers"]
+        response.raise_for_status()
+        data = response.json()
+        kept = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        self._write_cache(path, params, {"data": data, "headers": kept})
+        return data, kept
+
+    def post_json(self, path, data):
+        response = self.session.post(self._url(path), json=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
@@ -1,276 +1,380 @@
-import kivy
-import requests  # Add this import for making HTTP requests
-from kivy.app import App
-from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.button import Button
-from kivy.uix.textinput import TextInput
-from kivy.uix.label import Label
-from kivy.uix.screenmanager import ScreenManager, Screen
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.gridlayout import GridLayout
-
-kivy.require('2.1.0')
-
-# FastAPI server URL
-API_BASE_URL = "http://localhost:8000/products/"
-
-# Home Screen
-class HomeScreen(Screen):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        layout = BoxLayout(orientation="vertical", spacing=10, padding=10)
-        
-        product_button = Button(text="Manage Products")
-        product_button.bind(on_press=self.navigate_to_products)
-
-        customer_button = Button(text="Manage Customers")
-        customer_button.bind(on_press=self.navigate_to_customers)
-
-        order_button = Button(text="Manage Orders")
-        order_button.bind(on_press=self.navigate_to_orders)
-
-        layout.add_widget(product_button)
-        layout.add_widget(customer_button)
-        layout.add_widget(order_button)
-        
-        self.add_widget(layout)
-
-    def navigate_to_products(self, instance):
-        self.manager.current = "products"
-
-    def navigate_to_customers(self, instance):
-        self.manager.current = "customers"
-
-    def navigate_to_orders(self, instance):
-        self.manager.current = "orders"
-
-# Product Management Screen
-class ProductsScreen(Screen):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
-
-        add_product_button = Button(text="Add Product")
-        add_product_button.bind(on_press=self.navigate_to_add_product)
-
-        view_products_button = Button(text="View Products")
-        view_products_button.bind(on_press=self.navigate_to_view_products)
-
-        back_button = Button(text="Back to Home")
-        back_button.bind(on_press=self.navigate_to_home)
-
-        layout.add_widget(add_product_button)
-        layout.add_widget(view_products_button)
-        layout.add_widget(back_button)
-
-        self.add_widget(layout)
-
-    # Add a method to navigate to the Products screen
-    def navigate_to_products(self, instance):
-        self.manager.current = "products"
-
-    def navigate_to_add_product(self, instance):
-        self.manager.current = "add_product"
-
-    def navigate_to_view_products(self, instance):
-        self.manager.current = "view_products"
-
-    def navigate_to_home(self, instance):
-        self.manager.current = "home"
-
-    def view_products(self, instance):
-        response = requests.get(API_BASE_URL)
-        if response.status_code == 200:
-            products = response.json()
-            products_list = "\n".join(
-                [f"ID: {p['id']}, Name: {p['name']}, Price: {p['price']}, Quantity: {p['quantity']}" for p in products]
-            )
-            products_screen = Screen(name="view_products")
-            layout = BoxLayout(orientation="vertical")
-            label = Label(text=products_list, size_hint_y=None, height=500)
-            layout.add_widget(label)
-            back_button = Button(text="Back to Products")
-            back_button.bind(on_press=self.navigate_to_products)
-            layout.add_widget(back_button)
-            products_screen.add_widget(layout)
-            self.manager.add_widget(products_screen)
-            self.manager.current = "view_products"
-        else:
-            print("Failed to retrieve products")
-
-# Add Product Screen
-class AddProductScreen(Screen):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
-
-        self.name_input = TextInput(hint_text="Product Name", multiline=False)
-        self.price_input = TextInput(hint_text="Product Price", multiline=False)
-        self.quantity_input = TextInput(hint_text="Product Quantity", multiline=False)
-
-        add_button = Button(text="Add Product")
-        add_button.bind(on_press=self.add_product)
-
-        back_button = Button(text="Back to Products")
-        back_button.bind(on_press=self.navigate_to_products)
-
-        layout.add_widget(self.name_input)
-        layout.add_widget(self.price_input)
-        layout.add_widget(self.quantity_input)
-        layout.add_widget(add_button)
-        layout.add_widget(back_button)
-
-        self.add_widget(layout)
-
-    def add_product(self, instance):
-        name = self.name_input.text
-        price = self.price_input.text
-        quantity = self.quantity_input.text
-        
-        if not name or not price or not quantity:
-            print("All fields are required.")
-            return
-
-        try:
-            data = {
-                "name": name,
-                "price": float(price),
-                "quantity": int(quantity)
-            }
-            response = requests.post(API_BASE_URL, json=data)
-            if response.status_code == 200:
-                print("Product added successfully")
-                self.navigate_to_products(instance)
-            else:
-                print("Failed to add product")
-        except ValueError:
-            print("Invalid price or quantity format.")
-
-    def navigate_to_products(self, instance):
-        self.manager.current = "products"
-
-# Customer Management Screen
-class CustomersScreen(Screen):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
-
-        add_customer_button = Button(text="Add Customer")
-        add_customer_button.bind(on_press=self.navigate_to_add_customer)
-
-        view_customers_button = Button(text="View Customers")
-        view_customers_button.bind(on_press=self.navigate_to_view_customers)
-
-        back_button = Button(text="Back to Home")
-        back_button.bind(on_press=self.navigate_to_home)
-
-        layout.add_widget(add_customer_button)
-        layout.add_widget(view_customers_button)
-        layout.add_widget(back_button)
-
-        self.add_widget(layout)
-
-    def navigate_to_add_customer(self, instance):
-        self.manager.current = "add_customer"
-
-    def navigate_to_view_customers(self, instance):
-        self.manager.current = "view_customers"
-
-    def navigate_to_home(self, instance):
-        self.manager.current = "home"
-
-# Orders Management Screen
-class OrdersScreen(Screen):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
-
-        create_order_button = Button(text="Create Order")
-        create_order_button.bind(on_press=self.navigate_to_create_order)
-
-        view_orders_button = Button(text="View Orders")
-        view_orders_button.bind(on_press=self.navigate_to_view_orders)
-
-        back_button = Button(text="Back to Home")
-        back_button.bind(on_press=self.navigate_to_home)
-
-        layout.add_widget(create_order_button)
-        layout.add_widget(view_orders_button)
-        layout.add_widget(back_button)
-
-        self.add_widget(layout)
-
-    def navigate_to_create_order(self, instance):
-        self.manager.current = "create_order"
-
-    def navigate_to_view_orders(self, instance):
-        self.manager.current = "view_orders"
-
-    def navigate_to_home(self, instance):
-        self.manager.current = "home"
-
-class ViewProductsScreen(Screen):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
-        self.product_list = ScrollView()
-        self.layout = BoxLayout(orientation="vertical", size_hint_y=None)
-        self.layout.bind(minimum_height=self.layout.setter('height'))
-        self.product_list.add_widget(self.layout)
-        layout.add_widget(self.product_list)
-        
-        back_button = Button(text="Back to Products")
-        back_button.bind(on_press=self.navigate_to_products)
-        layout.add_widget(back_button)
-
-        self.add_widget(layout)
-        self.load_products()
-
-    def load_products(self):
-        try:
-            response = requests.get(API_BASE_URL)
-            response.raise_for_status()
-            products = response.json()
-
-            self.layout.clear_widgets()
-            if products:
-                for product in products:
-                    product_label = Label(
-                        text=f"Name: {product['name']}, Price: {product['price']}, Quantity: {product['quantity']}",
-                        size_hint_y=None, height=44
-                    )
-                    self.layout.add_widget(product_label)
-            else:
-                self.layout.add_widget(Label(text="No products available."))
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching products: {e}")
-            self.layout.clear_widgets()
-            self.layout.add_widget(Label(text="Failed to load products. Please try again later."))
-
-    def navigate_to_products(self, instance):
-        self.manager.current = "products"
-
-# Main App Class
-class ManagementApp(App):
-    def build(self):
-        sm = ScreenManager()
-
-        # Home Screen
-        sm.add_widget(HomeScreen(name="home"))
-
-        # Product Management Screens
-        sm.add_widget(ProductsScreen(name="products"))
-        sm.add_widget(AddProductScreen(name="add_product"))
-        sm.add_widget(ViewProductsScreen(name="view_products"))
-
-        # Customer Management Screens
-        sm.add_widget(CustomersScreen(name="customers"))
-
-        # Orders Management Screens
-        sm.add_widget(OrdersScreen(name="orders"))
-
-        return sm
-
-if __name__ == "__main__":
-    ManagementApp().run()
+import os
+import threading
+import kivy
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.textinput import TextInput
+from kivy.uix.label import Label
+from kivy.uix.screenmanager import ScreenManager, Screen
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+
+from api_client import ApiClient
+
+kivy.require('2.1.0')
+
+PAGE_SIZE = 100  # products fetched per request while scrolling
+
+# Runs a blocking call (HTTP request) on a background thread so the UI never freezes.
+# The result or the error is handed back on the Kivy main thread, unless the task was cancelled.
+class BackgroundTask:
+    def __init__(self, work, on_success, on_error=None):
+        self.work = work
+        self.on_success = on_success
+        self.on_error = on_error
+        self.cancelled = False
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _run(self):
+        try:
+            result = self.work()
+            callback = self.on_success
+        except Exception as e:
+            result = e
+            callback = self.on_error
+        Clock.schedule_once(lambda dt: self._deliver(callback, result))
+
+    def _deliver(self, callback, result):
+        if not self.cancelled and callback is not None:
+            callback(result)
+
+# Home Screen
+class HomeScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation="vertical", spacing=10, padding=10)
+        
+        product_button = Button(text="Manage Products")
+        product_button.bind(on_press=self.navigate_to_products)
+
+        customer_button = Button(text="Manage Customers")
+        customer_button.bind(on_press=self.navigate_to_customers)
+
+        order_button = Button(text="Manage Orders")
+        order_button.bind(on_press=self.navigate_to_orders)
+
+        layout.add_widget(product_button)
+        layout.add_widget(customer_button)
+        layout.add_widget(order_button)
+        
+        self.add_widget(layout)
+
+    def navigate_to_products(self, instance):
+        self.manager.current = "products"
+
+    def navigate_to_customers(self, instance):
+        self.manager.current = "customers"
+
+    def navigate_to_orders(self, instance):
+        self.manager.current = "orders"
+
+# Product Management Screen
+class ProductsScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        add_product_button = Button(text="Add Product")
+        add_product_button.bind(on_press=self.navigate_to_add_product)
+
+        view_products_button = Button(text="View Products")
+        view_products_button.bind(on_press=self.navigate_to_view_products)
+
+        back_button = Button(text="Back to Home")
+        back_button.bind(on_press=self.navigate_to_home)
+
+        layout.add_widget(add_product_button)
+        layout.add_widget(view_products_button)
+        layout.add_widget(back_button)
+
+        self.add_widget(layout)
+
+    # Add a method to navigate to the Products screen
+    def navigate_to_products(self, instance):
+        self.manager.current = "products"
+
+    def navigate_to_add_product(self, instance):
+        self.manager.current = "add_product"
+
+    def navigate_to_view_products(self, instance):
+        self.manager.current = "view_products"
+
+    def navigate_to_home(self, instance):
+        self.manager.current = "home"
+
+# Add Product Screen
+class AddProductScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        self.name_input = TextInput(hint_text="Product Name", multiline=False)
+        self.price_input = TextInput(hint_text="Product Price", multiline=False)
+        self.quantity_input = TextInput(hint_text="Product Quantity", multiline=False)
+
+        self.add_button = Button(text="Add Product")
+        self.add_button.bind(on_press=self.add_product)
+        self.add_task = None
+
+        back_button = Button(text="Back to Products")
+        back_button.bind(on_press=self.navigate_to_products)
+
+        layout.add_widget(self.name_input)
+        layout.add_widget(self.price_input)
+        layout.add_widget(self.quantity_input)
+        layout.add_widget(self.add_button)
+        layout.add_widget(back_button)
+
+        self.add_widget(layout)
+
+    def add_product(self, instance):
+        name = self.name_input.text
+        price = self.price_input.text
+        quantity = self.quantity_input.text
+        
+        if not name or not price or not quantity:
+            print("All fields are required.")
+            return
+
+        try:
+            data = {
+                "name": name,
+                "price": float(price),
+                "quantity": int(quantity)
+            }
+        except ValueError:
+            print("Invalid price or quantity format.")
+            return
+
+        # Loading indicator: the button is disabled until the server answers
+        self.add_button.disabled = True
+        self.add_button.text = "Adding..."
+        self.add_task = BackgroundTask(lambda: self.post_product(data), self.on_product_added,
+                                       self.on_add_error).start()
+
+    def post_product(self, data):
+        return App.get_running_app().api.post_json("/products/", data)
+
+    def on_product_added(self, product):
+        self.reset_add_button()
+        print("Product added successfully")
+        self.navigate_to_products(None)
+
+    def on_add_error(self, error):
+        self.reset_add_button()
+        print(f"Failed to add product: {error}")
+
+    def reset_add_button(self):
+        self.add_button.disabled = False
+        self.add_button.text = "Add Product"
+
+    # Leaving the screen drops the pending result (the request itself cannot be aborted)
+    def on_leave(self, *args):
+        if self.add_task:
+            self.add_task.cancel()
+            self.add_task = None
+        self.reset_add_button()
+
+    def navigate_to_products(self, instance):
+        self.manager.current = "products"
+
+# Customer Management Screen
+class CustomersScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        add_customer_button = Button(text="Add Customer")
+        add_customer_button.bind(on_press=self.navigate_to_add_customer)
+
+        view_customers_button = Button(text="View Customers")
+        view_customers_button.bind(on_press=self.navigate_to_view_customers)
+
+        back_button = Button(text="Back to Home")
+        back_button.bind(on_press=self.navigate_to_home)
+
+        layout.add_widget(add_customer_button)
+        layout.add_widget(view_customers_button)
+        layout.add_widget(back_button)
+
+        self.add_widget(layout)
+
+    def navigate_to_add_customer(self, instance):
+        self.manager.current = "add_customer"
+
+    def navigate_to_view_customers(self, instance):
+        self.manager.current = "view_customers"
+
+    def navigate_to_home(self, instance):
+        self.manager.current = "home"
+
+# Orders Management Screen
+class OrdersScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        create_order_button = Button(text="Create Order")
+        create_order_button.bind(on_press=self.navigate_to_create_order)
+
+        view_orders_button = Button(text="View Orders")
+        view_orders_button.bind(on_press=self.navigate_to_view_orders)
+
+        back_button = Button(text="Back to Home")
+        back_button.bind(on_press=self.navigate_to_home)
+
+        layout.add_widget(create_order_button)
+        layout.add_widget(view_orders_button)
+        layout.add_widget(back_button)
+
+        self.add_widget(layout)
+
+    def navigate_to_create_order(self, instance):
+        self.manager.current = "create_order"
+
+    def navigate_to_view_orders(self, instance):
+        self.manager.current = "view_orders"
+
+    def navigate_to_home(self, instance):
+        self.manager.current = "home"
+
+# Virtualized list: only the rows on screen get a widget, and they are reused while scrolling
+class ProductListView(RecycleView):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.viewclass = "Label"
+        layout = RecycleBoxLayout(orientation="vertical", size_hint_y=None,
+                                  default_size=(None, 44), default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+
+class ViewProductsScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+        self.status_label = Label(text="", size_hint_y=None, height=30)
+        layout.add_widget(self.status_label)
+        self.product_list = ProductListView()
+        self.product_list.bind(scroll_y=self.on_scroll)
+        layout.add_widget(self.product_list)
+        
+        back_button = Button(text="Back to Products")
+        back_button.bind(on_press=self.navigate_to_products)
+        layout.add_widget(back_button)
+
+        self.add_widget(layout)
+        self.load_task = None
+        self.next_after_id = 0  # keyset cursor of the next page, None once everything is loaded
+
+    # Load lazily, each time the screen is shown, instead of while the app is being built
+    def on_enter(self, *args):
+        self.load_products()
+
+    def on_leave(self, *args):
+        if self.load_task:
+            self.load_task.cancel()
+            self.load_task = None
+
+    # Start again from the first page. The last known first page is shown straight from the disk
+    # cache while it is revalidated in the background.
+    def load_products(self):
+        if self.load_task:
+            self.load_task.cancel()
+            self.load_task = None
+        self.product_list.data = []
+        self.next_after_id = 0
+        cached = App.get_running_app().api.cached_json("/products/", self.page_params(0))
+        if cached is not None:
+            self.show_page(self.to_page(*cached))
+            self.next_after_id = 0  # the revalidated first page replaces the cached one
+        self.load_next_page()
+
+    def page_params(self, after_id):
+        return {"after_id": after_id, "limit": PAGE_SIZE}
+
+    def to_page(self, products, headers):
+        next_after_id = headers.get("X-Next-After-Id")
+        return products, int(next_after_id) if next_after_id else None
+
+    def load_next_page(self):
+        if self.load_task or self.next_after_id is None:
+            return
+        self.status_label.text = "Loading products..."
+        after_id = self.next_after_id
+        self.load_task = BackgroundTask(lambda: self.fetch_page(after_id), self.show_page, self.on_load_error).start()
+
+    # Fetch more when the list is scrolled close to the bottom (scroll_y goes from 1 at the top to 0)
+    def on_scroll(self, instance, scroll_y):
+        if scroll_y < 0.1:
+            self.load_next_page()
+
+    def fetch_page(self, after_id):
+        return self.to_page(*App.get_running_app().api.get_json("/products/", self.page_params(after_id)))
+
+    def show_page(self, page):
+        products, next_after_id = page
+        first_page = self.next_after_id == 0
+        self.next_after_id = next_after_id
+        self.load_task = None
+        # Rows are only data; RecycleView recycles the visible Label widgets to display them
+        rows = [{"text": f"Name: {product['name']}, Price: {product['price']}, Quantity: {product['quantity']}"}
+                for product in products]
+        if first_page:
+            self.product_list.data = rows
+        else:
+            self.product_list.data.extend(rows)
+        if not self.product_list.data:
+            self.status_label.text = "No products available."
+        elif self.next_after_id is None:
+            self.status_label.text = f"{len(self.product_list.data)} products"
+        else:
+            self.status_label.text = f"{len(self.product_list.data)} products loaded, scroll for more"
+
+    def on_load_error(self, error):
+        self.load_task = None
+        print(f"Error fetching products: {error}")
+        if self.product_list.data:
+            self.status_label.text = "Server unreachable, showing the last known products."
+        else:
+            self.status_label.text = "Failed to load products. Please try again later."
+
+    def navigate_to_products(self, instance):
+        self.manager.current = "products"
+
+# Main App Class
+class ManagementApp(App):
+    def build(self):
+        # One HTTP client (keep-alive session and response cache) shared by every screen
+        self.api = ApiClient(cache_dir=os.path.join(self.user_data_dir, "http_cache"))
+
+        sm = ScreenManager()
+
+        # Home Screen
+        sm.add_widget(HomeScreen(name="home"))
+
+        # Product Management Screens
+        sm.add_widget(ProductsScreen(name="products"))
+        sm.add_widget(AddProductScreen(name="add_product"))
+        sm.add_widget(ViewProductsScreen(name="view_products"))
+
+        # Customer Management Screens
+        sm.add_widget(CustomersScreen(name="customers"))
+
+        # Orders Management Screens
+        sm.add_widget(OrdersScreen(name="orders"))
+
+        return sm
+
+    def on_stop(self):
+        self.api.close()
+
+if __name__ == "__main__":
+    ManagementApp().run()